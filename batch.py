@@ -0,0 +1,410 @@
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+from data import TwoLevelDataset
+from stats import Stats
+
+try:
+    # Limits the memory of the worker processes, not available on Windows.
+    import resource
+except ImportError:
+    resource = None
+
+# Default pattern for the names of the generated files, filled with the fields of the record.
+FILENAME_PATTERN = "{Company} - {Contact}.docx"
+
+# Default pattern for the names of the combined files, filled with the fields of the first record.
+COMBINED_FILENAME_PATTERN = "{Company}.docx"
+
+# Characters that are not allowed in file names on Windows or Linux.
+INVALID_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+# Number of chunks of records queued per worker process, bounding the records in flight.
+CHUNKS_PER_WORKER = 2
+
+
+class RenderResult:
+    def __init__(
+        self,
+        company: str,
+        contact: str,
+        path: str,
+        error: str = None,
+        sha256: str = None,
+        seconds: float = None,
+        stats: dict = None,
+    ) -> None:
+        """Class for the outcome of rendering the document of a single record,
+        or the combined document of the records of a company.
+
+        Args:
+            company (str): The company of the record.
+            contact (str): The contact of the record, None for a combined document.
+            path (str): Path to the generated file.
+            error (str, optional): Description of the error if the render failed. Defaults to None.
+            sha256 (str, optional): SHA-256 hex digest of the generated file. Defaults to None.
+            seconds (float, optional): Time taken to render and save the document. Defaults to None.
+            stats (dict, optional): The Stats of the render as a dict, if collected. Defaults to None.
+        """
+        self.company = company
+        self.contact = contact
+        self.path = path
+        self.error = error
+        self.sha256 = sha256
+        self.seconds = seconds
+        self.stats = stats
+
+    @property
+    def ok(self) -> bool:
+        """True if the document was generated successfully."""
+        return self.error is None
+
+    def __repr__(self) -> str:
+        status = "ok" if self.ok else f"error={self.error!r}"
+        return f"RenderResult({self.company!r}, {self.contact!r}, {self.path!r}, {status})"
+
+    def to_dict(self) -> dict:
+        """Returns the result as a JSON serializable dict."""
+        return {
+            "company": self.company,
+            "contact": self.contact,
+            "path": self.path,
+            "error": self.error,
+            "sha256": self.sha256,
+            "seconds": self.seconds,
+            "stats": self.stats,
+        }
+
+
+class Manifest:
+    def __init__(self, path: str, settings: dict = None) -> None:
+        """Class for the manifest of a batch run, a JSON lines file with a RenderResult per line.
+
+        The records already rendered successfully are read from an existing manifest,
+        so an interrupted run can be resumed by skipping them.
+
+        Args:
+            path (str): Path to the manifest file.
+            settings (dict, optional): The template and the options of the run, JSON serializable.
+                A new manifest starts with them, an existing one is only resumed if it was
+                written with the same settings, otherwise a ValueError is raised.
+                Defaults to None, the settings are not checked.
+        """
+        self.path = path
+        self.completed = {}
+        written = None
+        empty = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not empty:
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line of an interrupted run may be incomplete.
+                        continue
+                    if "settings" in entry:
+                        written = entry["settings"]
+                        continue
+                    key = (entry["company"], entry["contact"])
+                    if entry["error"] is None and os.path.exists(entry["path"]):
+                        self.completed[key] = entry
+                    else:
+                        self.completed.pop(key, None)
+        if settings is None:
+            return
+        if empty:
+            self._write({"settings": settings})
+        elif written != settings:
+            written = written or {}
+            changed = sorted(
+                name for name in set(settings) | set(written) if settings.get(name) != written.get(name)
+            )
+            raise ValueError(
+                f"The manifest {path} was written by a run with other settings: {', '.join(changed)}"
+            )
+
+    def _write(self, entry: dict):
+        """Appends ENTRY to the manifest file as a JSON line, flushing it to the disk."""
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def is_completed(self, company: str, contact: str) -> bool:
+        """True if the record was rendered successfully in an earlier run."""
+        return (company, contact) in self.completed
+
+    def record(self, result: RenderResult):
+        """Appends RESULT to the manifest file, flushing it to the disk."""
+        self._write(result.to_dict())
+        if result.ok:
+            self.completed[(result.company, result.contact)] = result.to_dict()
+
+
+def record_fields(dataset: TwoLevelDataset, company: str, contact: str) -> dict:
+    """Returns the fields of the record of CONTACT at COMPANY, the same way the GUI shows them."""
+    fields = {"Company": company, "Contact": contact}
+    fields.update(dataset.get_data()[company][contact])
+    if "Date" not in fields:
+        fields["Date"] = datetime.date.today().isoformat()
+    return fields
+
+
+def fields_to_templates(fields: dict) -> dict:
+    """Returns the templates to substitute for the FIELDS of a record."""
+    return {str(key).lower(): value for key, value in fields.items()}
+
+
+def output_filename(pattern: str, fields: dict) -> str:
+    """Returns the file name built from PATTERN and the FIELDS of a record,
+    with the characters not allowed in file names replaced.
+
+    Raises ValueError if PATTERN is not valid or uses a field the record does not have."""
+    try:
+        name = pattern.format(**fields)
+    except KeyError as err:
+        raise ValueError(
+            f"Unknown field {err} in the file name pattern {pattern!r}, "
+            f"the fields are: {', '.join(map(str, fields))}"
+        ) from None
+    except (IndexError, ValueError) as err:
+        raise ValueError(f"Invalid file name pattern {pattern!r}: {err}") from None
+    return INVALID_FILENAME_CHARS.sub("_", name)
+
+
+def file_sha256(path: str) -> str:
+    """Returns the SHA-256 hex digest of the file at PATH."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def select_records(dataset: TwoLevelDataset, companies: list = None, contacts: list = None) -> list:
+    """Returns the (company, contact) pairs of the dataset.
+
+    If COMPANIES is given only the records of those companies are selected,
+    if CONTACTS is given only the records of those contacts are selected.
+    The names are matched case-insensitively, as the keys of the dataset are title-cased.
+    Raises ValueError if a company is not in the dataset, or a contact matches no record."""
+    if companies is None:
+        companies = dataset.get_primary_list()
+    else:
+        known = {company.casefold(): company for company in dataset.get_primary_list()}
+        unknown = [company for company in companies if company.casefold() not in known]
+        if unknown:
+            raise ValueError(f"Unknown companies: {', '.join(unknown)}")
+        companies = list(dict.fromkeys(known[company.casefold()] for company in companies))
+    wanted = None if contacts is None else {contact.casefold() for contact in contacts}
+    found = set()
+    records = []
+    for company in companies:
+        for contact in dataset.get_secondary_list(company):
+            if wanted is None or contact.casefold() in wanted:
+                records.append((company, contact))
+                found.add(contact.casefold())
+    if wanted is not None:
+        unknown = [contact for contact in contacts if contact.casefold() not in found]
+        if unknown:
+            raise ValueError(f"Unknown contacts: {', '.join(unknown)}")
+    return records
+
+
+# The template parsed once in every worker process, whether the renders are measured,
+# and how the records of the combined documents are separated.
+_template = None
+_collect_stats = False
+_separator = "page"
+
+
+def _init_worker(
+    input_file: str,
+    template_start: str,
+    template_end: str,
+    engine: str = "docx",
+    max_memory: int = None,
+    collect_stats: bool = False,
+    separator: str = "page",
+):
+    """Parses the template in the worker process, limiting its memory to MAX_MEMORY bytes."""
+    # Imported here, so the GUI importing this module does not load python-docx at startup.
+    from templating import CompiledTemplate
+
+    global _template, _collect_stats, _separator
+    _collect_stats = collect_stats
+    _separator = separator
+    if max_memory:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+    _template = CompiledTemplate(input_file, template_start, template_end, engine)
+
+
+def _render_record(job: tuple) -> RenderResult:
+    """Renders and saves the document of a single record in the worker process.
+
+    If the templates of the job are a list, they are rendered into a combined document.
+    The loops of the template are repeated for the records of the job, if it has any."""
+    company, contact, templates, records, path = job
+    start = time.perf_counter()
+    stats = Stats() if _collect_stats else None
+    try:
+        if isinstance(templates, list):
+            document = _template.render_combined(templates, _separator, stats)
+        else:
+            document = _template.render(templates, stats, records)
+        _template.save(document, path, stats)
+        # Hashed from the written file, so the document is not held in memory twice.
+        sha256 = file_sha256(path)
+    except Exception as err:
+        return RenderResult(company, contact, path, f"{type(err).__name__}: {err}")
+    return RenderResult(
+        company,
+        contact,
+        path,
+        sha256=sha256,
+        seconds=time.perf_counter() - start,
+        stats=stats.to_dict() if stats else None,
+    )
+
+
+def _render_chunk(jobs: list) -> list:
+    """Renders the documents of a chunk of records in the worker process."""
+    return [_render_record(job) for job in jobs]
+
+
+def render_batch(
+    input_file: str,
+    dataset: TwoLevelDataset,
+    output_dir: str,
+    template_start: str = "\[",
+    template_end: str = "]",
+    records: list = None,
+    filename_pattern: str = None,
+    workers: int = None,
+    on_result=None,
+    engine: str = "docx",
+    max_memory: int = None,
+    max_tasks_per_child: int = None,
+    stats: bool = False,
+    combine: bool = False,
+    separator: str = "page",
+    loops: bool = False,
+    loop_records: list = None,
+) -> list:
+    """Renders the template INPUT_FILE for the RECORDS of the DATASET into OUTPUT_DIR.
+
+    RECORDS is a list of (company, contact) pairs, defaults to every record of the dataset.
+    The documents are rendered on a pool of WORKERS processes (defaults to the number of CPUs),
+    each parsing the template once. The name of each file is built from FILENAME_PATTERN
+    filled with the fields of the record, defaults to FILENAME_PATTERN.
+    ON_RESULT is called with the RenderResult of every record as it finishes.
+    ENGINE selects how the template is indexed, see Templating.
+    MAX_MEMORY limits the address space of every worker process in bytes (Unix only),
+    a render running out of it fails with a MemoryError. MAX_TASKS_PER_CHILD replaces the
+    worker processes after that many chunks of records. Both only apply if WORKERS is above 1.
+    If STATS is True, the phase durations and counters of every render are measured,
+    and kept in its RenderResult as a dict (see Stats.to_dict).
+    If COMBINE is True, the records of every company are rendered into a single document,
+    separated by a page or a section break (SEPARATOR "page" or "section"), see
+    CompiledTemplate.render_combined. The file names are filled with the fields of the first
+    record of the company, FILENAME_PATTERN defaults to COMBINED_FILENAME_PATTERN.
+    If LOOPS is True, the loops of the template are repeated for the LOOP_RECORDS of the company,
+    see Templating. LOOP_RECORDS is a list of (company, contact) pairs, defaults to every record of
+    the companies rendered, so a document does not depend on which of the records are rendered.
+    Together with COMBINE, every company gets a single document rendered with the fields of its
+    first record and its loops repeated, instead of the body repeated.
+
+    Returns the list of RenderResult in the order of the records, or of the companies.
+    Raises ValueError if MAX_MEMORY is not supported on this platform, or MAX_TASKS_PER_CHILD
+    by this Python version."""
+    if max_memory and resource is None:
+        raise ValueError("Limiting the memory of the workers is not supported on this platform")
+    if max_tasks_per_child and sys.version_info < (3, 11):
+        raise ValueError("Replacing the worker processes needs Python 3.11 or later")
+    if records is None:
+        records = select_records(dataset)
+    fields = [record_fields(dataset, company, contact) for company, contact in records]
+    templates = [fields_to_templates(record) for record in fields]
+    # The templates of the loop records of every company, shared by its jobs.
+    loop_templates = {}
+    if loops:
+        companies = list(dict.fromkeys(company for company, _ in records))
+        if loop_records is None:
+            loop_records = select_records(dataset, companies)
+        companies = set(companies)
+        for company, contact in loop_records:
+            if company in companies:
+                loop_templates.setdefault(company, []).append(
+                    fields_to_templates(record_fields(dataset, company, contact))
+                )
+    jobs = []
+    if combine:
+        filename_pattern = filename_pattern or COMBINED_FILENAME_PATTERN
+        # The fields of the first record and the templates of the records of every company.
+        company_records = {}
+        for (company, _), record, record_templates in zip(records, fields, templates):
+            company_records.setdefault(company, (record, []))[1].append(record_templates)
+        for company, (record, company_templates) in company_records.items():
+            path = os.path.join("", output_dir, output_filename(filename_pattern, record))
+            if loops:
+                jobs.append(
+                    (company, None, company_templates[0], loop_templates.get(company, []), path)
+                )
+            else:
+                jobs.append((company, None, company_templates, None, path))
+    else:
+        filename_pattern = filename_pattern or FILENAME_PATTERN
+        for (company, contact), record, record_templates in zip(records, fields, templates):
+            path = os.path.join("", output_dir, output_filename(filename_pattern, record))
+            records_templates = loop_templates.get(company, []) if loops else None
+            jobs.append((company, contact, record_templates, records_templates, path))
+
+    workers = workers or os.cpu_count() or 1
+    results = [None] * len(jobs)
+    if workers == 1:
+        _init_worker(
+            input_file, template_start, template_end, engine, collect_stats=stats, separator=separator
+        )
+        for i, job in enumerate(jobs):
+            results[i] = _render_record(job)
+            if on_result:
+                on_result(results[i])
+        return results
+
+    chunksize = max(1, min(64, len(jobs) // (workers * 4)))
+    chunks = iter(range(0, len(jobs), chunksize))
+    # Only passed if set, the argument is new in Python 3.11.
+    pool_options = {"max_tasks_per_child": max_tasks_per_child} if max_tasks_per_child else {}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(input_file, template_start, template_end, engine, max_memory, stats, separator),
+        **pool_options,
+    ) as executor:
+        # Only a limited number of chunks is queued at a time, the rest is submitted as they finish.
+        pending = {}
+
+        def submit_next():
+            start = next(chunks, None)
+            if start is not None:
+                future = executor.submit(_render_chunk, jobs[start : start + chunksize])
+                pending[future] = start
+
+        for _ in range(workers * CHUNKS_PER_WORKER):
+            submit_next()
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                start = pending.pop(future)
+                for i, result in enumerate(future.result(), start):
+                    results[i] = result
+                    if on_result:
+                        on_result(result)
+                submit_next()
+    return results
@@ -0,0 +1,309 @@
+import argparse
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+import docx
+from docx.shared import Inches
+
+from data import BACKENDS, TwoLevelDataset
+from templating import ENGINES, CompiledTemplate, Templating
+
+try:
+    # Measures the peak memory of the phases, not available on Windows.
+    import resource
+except ImportError:
+    resource = None
+
+TEMPLATE_START = r"\[\["
+TEMPLATE_END = "]]"
+
+# Names of the placeholders of the synthetic templates, and the columns of the synthetic CSVs.
+FIELDS = ["company", "contact", "prefix", "email", "phone", "address"]
+
+# Bytes of the unit of ru_maxrss, kilobytes except on macOS.
+MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def make_png(size: int) -> bytes:
+    """Returns a PNG image of random pixels, of roughly SIZE bytes."""
+    side = max(1, int((size / 3) ** 0.5))
+    rows = b"".join(b"\x00" + random.randbytes(side * 3) for _ in range(side))
+
+    def chunk(kind: bytes, content: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(content))
+            + kind
+            + content
+            + struct.pack(">I", zlib.crc32(kind + content))
+        )
+
+    header = struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(rows, 1))
+        + chunk(b"IEND", b"")
+    )
+
+
+def add_placeholder_paragraph(container, text: str, field: str, split: int):
+    """Adds a paragraph to CONTAINER with TEXT and the placeholder of FIELD split into SPLIT runs."""
+    paragraph = container.add_paragraph(text)
+    placeholder = f"[[{field}]]"
+    size = max(1, -(-len(placeholder) // split))
+    for i in range(0, len(placeholder), size):
+        paragraph.add_run(placeholder[i : i + size])
+    paragraph.add_run(" end.")
+    return paragraph
+
+
+def make_template(
+    path: str,
+    paragraphs: int = 10,
+    split: int = 1,
+    table_rows: int = 0,
+    table_cols: int = 4,
+    sections: int = 1,
+    headers: bool = True,
+    media_kb: int = 0,
+):
+    """Writes a synthetic .docx template to PATH.
+
+    Every paragraph, table cell, header and footer holds a placeholder split into SPLIT runs.
+    With HEADERS, every section has its own header and footer instead of the linked ones."""
+    document = docx.Document()
+    fields = itertools.cycle(FIELDS)
+    for section_number in range(sections):
+        if section_number:
+            document.add_section()
+        section = document.sections[-1]
+        if headers:
+            for component in (section.header, section.footer):
+                component.is_linked_to_previous = False
+                add_placeholder_paragraph(component, f"Section {section_number} ", next(fields), split)
+        for i in range(paragraphs):
+            add_placeholder_paragraph(document, f"Paragraph {i} of {section_number}: ", next(fields), split)
+        if table_rows:
+            table = document.add_table(rows=table_rows, cols=table_cols)
+            for row in table.rows:
+                for cell in row.cells:
+                    add_placeholder_paragraph(cell, "Cell ", next(fields), split)
+    if media_kb:
+        document.add_picture(io.BytesIO(make_png(media_kb * 1024)), width=Inches(1))
+    document.save(path)
+
+
+def make_csv(path: str, rows: int = 1000, columns: int = 6, contacts_per_company: int = 10):
+    """Writes a synthetic CSV dataset of ROWS records and COLUMNS columns to PATH."""
+    header = FIELDS[: min(columns, len(FIELDS))]
+    header += [f"extra_{i}" for i in range(columns - len(header))]
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        for i in range(rows):
+            company = f"company {i // contacts_per_company}"
+            writer.writerow(
+                [company, f"contact {i}"] + [f"value {i} {j}" for j in range(2, columns)]
+            )
+
+
+def measure(function, repeat: int, setup=None) -> dict:
+    """Runs FUNCTION REPEAT times, returns the durations and the peak memory.
+
+    If SETUP is given, its result is passed to FUNCTION, and it is not measured.
+    The peak memory is measured in separate runs, as tracing slows down the allocations:
+    the peak of the Python heap with tracemalloc, which misses the memory of libxml2,
+    and the peak resident set size of a child process running FUNCTION once, see peak_rss."""
+    if setup is None:
+        setup = lambda: None  # noqa: E731
+        run = lambda _: function()  # noqa: E731
+    else:
+        run = function
+    durations = []
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        run(argument)
+        durations.append(time.perf_counter() - start)
+    argument = setup()
+    tracemalloc.start()
+    run(argument)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds_min": min(durations),
+        "seconds_mean": statistics.mean(durations),
+        "peak_python_bytes": peak,
+        **peak_rss(run, setup),
+    }
+
+
+def peak_rss(run, setup) -> dict:
+    """Runs RUN with the result of SETUP once in a forked child process, returns its peak
+    resident set size, and how much RUN raised it above the peak after SETUP, in bytes.
+
+    Unlike tracemalloc this covers the memory of libxml2 too. The peak is that of the child
+    itself, as the one of RUSAGE_CHILDREN is the largest of every child waited for so far.
+    The values are None where fork or resource is not available (Windows)."""
+    if resource is None or "fork" not in multiprocessing.get_all_start_methods():
+        return {"peak_rss_bytes": None, "peak_rss_increase_bytes": None}
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_peak_rss_child, args=(run, setup, sender))
+    process.start()
+    sender.close()
+    try:
+        before, after = receiver.recv()
+    finally:
+        receiver.close()
+        process.join()
+    return {"peak_rss_bytes": after, "peak_rss_increase_bytes": after - before}
+
+
+def _peak_rss_child(run, setup, connection):
+    """Sends the peak resident set size of the process after SETUP, and after RUN, to CONNECTION."""
+    argument = setup()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+    run(argument)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+    connection.send((before, after))
+    connection.close()
+
+
+def bench_template(path: str, params: dict, engine: str, repeat: int) -> list:
+    """Benchmarks the load, substitute, save and render phases of the template at PATH."""
+    values = {field: f"{field} value" for field in FIELDS}
+    results = []
+
+    def result(phase: str, measured: dict, units: int, unit: str):
+        measured["throughput"] = units / measured["seconds_mean"] if measured["seconds_mean"] else None
+        results.append(
+            {"phase": phase, "engine": engine, "params": params, "unit": unit, "units": units, **measured}
+        )
+
+    template = Templating(path, None, TEMPLATE_START, TEMPLATE_END, values, engine=engine)
+    pattern = template.template_pattern(values)
+    placeholders = sum(len(pattern.findall(paragraph.text)) for paragraph in template.paragraph_index)
+
+    def load() -> Templating:
+        return Templating(path, None, TEMPLATE_START, TEMPLATE_END, values, engine=engine)
+
+    result("load", measure(load, repeat), 1, "documents")
+    # The substitution needs a freshly loaded document every time.
+    result(
+        "substitute",
+        measure(lambda loaded: loaded.sub_templates(), repeat, load),
+        placeholders,
+        "placeholders",
+    )
+
+    template.sub_templates()
+    result("save", measure(lambda: template.write(io.BytesIO()), repeat), 1, "documents")
+
+    compiled = CompiledTemplate(path, TEMPLATE_START, TEMPLATE_END, engine)
+    result("render", measure(lambda: compiled.render_bytes(values), repeat), 1, "documents")
+    return results
+
+
+def bench_dataset(path: str, params: dict, backend: str, repeat: int) -> list:
+    """Benchmarks building the TwoLevelDataset from the CSV at PATH with BACKEND."""
+    measured = measure(lambda: TwoLevelDataset(path, backend=backend), repeat)
+    measured["throughput"] = params["csv_rows"] / measured["seconds_mean"]
+    return [
+        {
+            "phase": "dataset",
+            "backend": backend,
+            "params": params,
+            "unit": "rows",
+            "units": params["csv_rows"],
+            **measured,
+        }
+    ]
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """Parses the command line arguments of the benchmark."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the templating and the dataset loading on synthetic data. "
+        "Every combination of the listed values is measured."
+    )
+    parser.add_argument("--paragraphs", type=int, nargs="+", default=[10, 200], help="paragraphs per section")
+    parser.add_argument("--split", type=int, nargs="+", default=[1, 4], help="runs per placeholder")
+    parser.add_argument("--table-rows", type=int, nargs="+", default=[0, 50], help="table rows per section")
+    parser.add_argument("--table-cols", type=int, default=4, help="table columns")
+    parser.add_argument("--sections", type=int, nargs="+", default=[1, 10], help="sections")
+    parser.add_argument(
+        "--no-headers", action="store_true", help="link the headers and footers instead of one per section"
+    )
+    parser.add_argument("--media-kb", type=int, nargs="+", default=[0, 1024], help="size of the embedded image")
+    parser.add_argument("--csv-rows", type=int, nargs="+", default=[1000, 100000], help="rows of the CSV")
+    parser.add_argument("--csv-cols", type=int, nargs="+", default=[6, 30], help="columns of the CSV")
+    parser.add_argument("--engine", choices=ENGINES, nargs="+", default=["docx"], help="templating engines")
+    parser.add_argument("--backend", choices=BACKENDS, nargs="+", default=["pandas"], help="dataset backends")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of every measurement")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random media content")
+    parser.add_argument("--output", default=None, help="file to write the JSON results to (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    """Runs the benchmarks and writes the results as JSON."""
+    args = parse_args(argv)
+    random.seed(args.seed)
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for paragraphs, split, table_rows, sections, media_kb in itertools.product(
+            args.paragraphs, args.split, args.table_rows, args.sections, args.media_kb
+        ):
+            params = {
+                "paragraphs": paragraphs,
+                "split": split,
+                "table_rows": table_rows,
+                "table_cols": args.table_cols,
+                "sections": sections,
+                "headers": not args.no_headers,
+                "media_kb": media_kb,
+            }
+            path = os.path.join(folder, "template.docx")
+            make_template(path, paragraphs, split, table_rows, args.table_cols, sections, not args.no_headers, media_kb)
+            for engine in args.engine:
+                print(f"Template {params} ({engine})", file=sys.stderr)
+                results += bench_template(path, params, engine, args.repeat)
+
+        for rows, columns in itertools.product(args.csv_rows, args.csv_cols):
+            params = {"csv_rows": rows, "csv_cols": columns}
+            path = os.path.join(folder, "data.csv")
+            make_csv(path, rows, columns)
+            for backend in args.backend:
+                print(f"Dataset {params} ({backend})", file=sys.stderr)
+                results += bench_dataset(path, params, backend, args.repeat)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
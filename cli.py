@@ -0,0 +1,217 @@
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+from batch import (
+    COMBINED_FILENAME_PATTERN,
+    FILENAME_PATTERN,
+    Manifest,
+    file_sha256,
+    render_batch,
+    select_records,
+)
+from data import BACKENDS, TwoLevelDataset
+from main import DATA_BACKEND, DATA_SEPARATOR, DATA_SOURCE, TEMPLATE_END, TEMPLATE_START
+from options import ENGINES, SEPARATORS
+from stats import Stats
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """Parses the command line arguments of the batch rendering."""
+    parser = argparse.ArgumentParser(
+        description="Render a .docx template for the records of a CSV dataset, without the GUI."
+    )
+    parser.add_argument("template", help="path to the .docx template")
+    parser.add_argument("output_dir", help="folder to write the generated documents to")
+    parser.add_argument("--data", default=DATA_SOURCE, help="path to the CSV dataset")
+    parser.add_argument("--separator", default=DATA_SEPARATOR, help="separator of the CSV")
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default=DATA_BACKEND, help="how the CSV is read"
+    )
+    parser.add_argument(
+        "--start", default=TEMPLATE_START, help="regex pattern of the template start designator"
+    )
+    parser.add_argument(
+        "--end", default=TEMPLATE_END, help="regex pattern of the template end designator"
+    )
+    parser.add_argument(
+        "--company", action="append", help="only render the records of this company (repeatable)"
+    )
+    parser.add_argument(
+        "--contact", action="append", help="only render the records of this contact (repeatable)"
+    )
+    parser.add_argument(
+        "--pattern",
+        default=None,
+        help=f'pattern of the generated file names (default: "{FILENAME_PATTERN}", '
+        f'with --combine "{COMBINED_FILENAME_PATTERN}")',
+    )
+    parser.add_argument(
+        "--combine",
+        action="store_true",
+        help="render the records of every company into a single document",
+    )
+    parser.add_argument(
+        "--record-break",
+        choices=SEPARATORS,
+        default="page",
+        help="break between the records of a combined document",
+    )
+    parser.add_argument(
+        "--loops",
+        action="store_true",
+        help="repeat the loops of the template for the records of the company "
+        "(with --combine, once per company instead of repeating the body)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="number of worker processes (default: CPUs)"
+    )
+    parser.add_argument(
+        "--max-memory", type=int, default=None, help="memory limit of every worker process in MB"
+    )
+    parser.add_argument(
+        "--max-tasks-per-child",
+        type=int,
+        default=None,
+        help="replace the worker processes after this many chunks of records",
+    )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help="path to the manifest of the run (default: OUTPUT_DIR/manifest.jsonl)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="render every selected record, even if the manifest has it completed "
+        "(needed to change the template or the options of a run)",
+    )
+    parser.add_argument("--engine", choices=ENGINES, default="docx", help="templating engine")
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="record the phase timings and counters of every render in the manifest, "
+        "and log the totals as JSON lines",
+    )
+    return parser.parse_args(argv)
+
+
+def run_settings(args: argparse.Namespace) -> dict:
+    """Returns the template, the dataset and the options of the run that change the generated
+    documents, a run is only resumed with the same ones."""
+    return {
+        "template_sha256": file_sha256(args.template),
+        "data": os.path.abspath(args.data),
+        "data_sha256": file_sha256(args.data),
+        "separator": args.separator,
+        "start": args.start,
+        "end": args.end,
+        "engine": args.engine,
+        "pattern": args.pattern,
+        "combine": args.combine,
+        "record_break": args.record_break,
+        "loops": args.loops,
+    }
+
+
+def prepare_run(args: argparse.Namespace) -> tuple:
+    """Opens the manifest, reads the dataset and selects the records of the run.
+
+    Returns the manifest, the dataset, the selected records and the pending ones.
+    Raises OSError or ValueError with a message for the user if the run can not start."""
+    if not os.path.isfile(args.template):
+        raise ValueError(f"Template not found: {args.template}")
+    if not os.path.isfile(args.data):
+        raise ValueError(f"Dataset not found: {args.data}")
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.output_dir, "manifest.jsonl")
+    if args.restart and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    try:
+        manifest = Manifest(manifest_path, run_settings(args))
+    except ValueError as err:
+        raise ValueError(f"{err}. Use --restart to render every record again.") from None
+
+    dataset_stats = Stats() if args.stats else None
+    dataset = TwoLevelDataset(args.data, args.separator, stats=dataset_stats, backend=args.backend)
+    if dataset_stats:
+        dataset_stats.log(event="dataset", data=args.data)
+    records = select_records(dataset, args.company, args.contact)
+    if args.combine:
+        # A combined document is recorded in the manifest without a contact.
+        pending = [record for record in records if not manifest.is_completed(record[0], None)]
+    else:
+        pending = [record for record in records if not manifest.is_completed(*record)]
+    return manifest, dataset, records, pending
+
+
+def main(argv: list = None) -> int:
+    """Renders the selected records, resuming from the manifest of an earlier run.
+
+    Returns the exit code, 1 if any of the records failed, 2 if the run could not be started
+    (e.g. unknown companies, or a manifest of a run with other settings) or resumed."""
+    args = parse_args(argv)
+    if args.stats:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        manifest, dataset, records, pending = prepare_run(args)
+    except (OSError, ValueError) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        return 2
+    skipped = len(records) - len(pending)
+    print(f"{len(pending)} records to render, {skipped} already completed.", file=sys.stderr)
+
+    def on_result(result):
+        manifest.record(result)
+        if not result.ok:
+            name = result.company if result.contact is None else f"{result.company} / {result.contact}"
+            print(f"Failed: {name}: {result.error}", file=sys.stderr)
+
+    try:
+        results = render_batch(
+            args.template,
+            dataset,
+            args.output_dir,
+            args.start,
+            args.end,
+            records=pending,
+            filename_pattern=args.pattern,
+            workers=args.workers,
+            on_result=on_result,
+            engine=args.engine,
+            max_memory=args.max_memory * 1024 * 1024 if args.max_memory else None,
+            max_tasks_per_child=args.max_tasks_per_child,
+            stats=args.stats,
+            combine=args.combine,
+            separator=args.record_break,
+            loops=args.loops,
+            # The loops list every record of the company, whichever are pending or selected.
+            loop_records=select_records(dataset, args.company) if args.loops else None,
+        )
+    except BrokenProcessPool as err:
+        # E.g. a worker process could not even parse the template within --max-memory.
+        print(f"A worker process died, the run can be resumed: {err}", file=sys.stderr)
+        return 2
+    except ValueError as err:
+        # Raised before any record is rendered, e.g. a field of --pattern missing from the dataset.
+        print(f"Error: {err}", file=sys.stderr)
+        return 2
+    failed = sum(not result.ok for result in results)
+    if args.stats:
+        totals = Stats()
+        for result in results:
+            if result.stats:
+                totals.merge(result.stats)
+        totals.log(event="batch", template=args.template, records=len(results), failed=failed)
+    print(
+        f"{len(results) - failed} rendered, {failed} failed, {skipped} skipped. "
+        f"Manifest: {manifest.path}",
+        file=sys.stderr,
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
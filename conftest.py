@@ -0,0 +1,148 @@
+import io
+import itertools
+import re
+import struct
+import zipfile
+import zlib
+
+import docx
+import pytest
+from docx.oxml.ns import qn
+from docx.shared import Inches
+from lxml import etree
+
+
+# The designators of the templates built by the tests, the ones of main.py.
+START = r"\[\["
+END = "]]"
+
+# Names of the placeholders of the built templates, and values to substitute for them.
+FIELDS = ["company", "contact", "prefix", "email", "phone", "address"]
+VALUES = {field: f"{field} value" for field in FIELDS}
+OTHER_VALUES = {field: f"other {field}" for field in FIELDS}
+
+# The records the loops of the loop template are repeated for.
+RECORDS = [
+    {"contact": "John", "email": "john@acme.test"},
+    {"contact": "Jane", "email": "jane@acme.test"},
+]
+
+
+def make_png(side: int = 64) -> bytes:
+    """Returns a PNG image of SIDE x SIDE pixels."""
+    rows = b"".join(
+        b"\x00" + bytes((x * 7 + y * 13) % 256 for x in range(side * 3)) for y in range(side)
+    )
+
+    def chunk(kind: bytes, content: bytes) -> bytes:
+        crc = zlib.crc32(kind + content)
+        return struct.pack(">I", len(content)) + kind + content + struct.pack(">I", crc)
+
+    header = struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+def add_placeholder_paragraph(container, text: str, field: str, split: int = 1):
+    """Adds a paragraph to CONTAINER with TEXT and the placeholder of FIELD split into SPLIT runs."""
+    paragraph = container.add_paragraph(text)
+    placeholder = f"[[{field}]]"
+    size = max(1, -(-len(placeholder) // split))
+    for i in range(0, len(placeholder), size):
+        paragraph.add_run(placeholder[i : i + size])
+    paragraph.add_run(" end.")
+    return paragraph
+
+
+def build_template(
+    path: str,
+    paragraphs: int = 3,
+    split: int = 1,
+    table_rows: int = 0,
+    sections: int = 1,
+    headers: bool = True,
+    media: bool = False,
+) -> str:
+    """Writes a .docx template to PATH, every paragraph, table cell, header and footer holding
+    a placeholder of FIELDS split into SPLIT runs. Returns PATH."""
+    document = docx.Document()
+    fields = itertools.cycle(FIELDS)
+    for section_number in range(sections):
+        if section_number:
+            document.add_section()
+        section = document.sections[-1]
+        if headers:
+            for component in (section.header, section.footer):
+                component.is_linked_to_previous = False
+                add_placeholder_paragraph(component, f"Section {section_number} ", next(fields), split)
+        for i in range(paragraphs):
+            text = f"Paragraph {i} of {section_number}: "
+            add_placeholder_paragraph(document, text, next(fields), split)
+        if table_rows:
+            table = document.add_table(rows=table_rows, cols=2)
+            for row in table.rows:
+                for cell in row.cells:
+                    add_placeholder_paragraph(cell, "Cell ", next(fields), split)
+    if media:
+        document.add_picture(io.BytesIO(make_png()), width=Inches(1))
+    document.save(path)
+    return path
+
+
+def build_loop_template(path: str) -> str:
+    """Writes a .docx template to PATH with a block loop of the contacts, and a table
+    with a row repeated for every contact. Returns PATH."""
+    document = docx.Document()
+    document.add_paragraph("Contacts of [[company]]:")
+    document.add_paragraph("[[#each]]")
+    document.add_paragraph("Name: [[contact]]")
+    document.add_paragraph("[[/each]]")
+    table = document.add_table(rows=2, cols=2)
+    table.cell(0, 0).text = "Name"
+    table.cell(0, 1).text = "Email"
+    table.cell(1, 0).text = "[[#each]][[contact]]"
+    table.cell(1, 1).text = "[[email]]"
+    document.add_paragraph("End of [[company]]")
+    document.save(path)
+    return path
+
+
+def parts(content: bytes) -> dict:
+    """Returns the members of the .docx CONTENT by name."""
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def text(content: bytes) -> str:
+    """Returns the text of the body, the headers and the footers of the .docx CONTENT."""
+    texts = []
+    for name, xml in parts(content).items():
+        if re.fullmatch(r"word/(document|header\d*|footer\d*)\.xml", name):
+            texts += [node.text or "" for node in etree.fromstring(xml).iter(qn("w:t"))]
+    return "\n".join(texts)
+
+
+def table_rows(document, index: int = 0) -> list:
+    """Returns the texts of the cells of the table INDEX of DOCUMENT, a path or the .docx content."""
+    if isinstance(document, bytes):
+        document = io.BytesIO(document)
+    return [[cell.text for cell in row.cells] for row in docx.Document(document).tables[index].rows]
+
+
+@pytest.fixture
+def make_template(tmp_path):
+    """Returns a function building a template in the temporary folder, see build_template."""
+
+    def make(name: str = "template.docx", **params) -> str:
+        return build_template(str(tmp_path / name), **params)
+
+    return make
+
+
+@pytest.fixture
+def loop_template(tmp_path) -> str:
+    return build_loop_template(str(tmp_path / "loop.docx"))
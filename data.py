@@ -1,8 +1,49 @@
-import pandas as pd
+import csv
+import json
+import math
+import os
+import re
+import typing
+
+from collections.abc import Mapping
+
+from stats import NULL_STATS, Stats
+
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
+
+# Version of the cache file format, caches of other versions are rebuilt.
+CACHE_VERSION = 4
+
+# The ways the CSV can be read, see TwoLevelDataset.
+BACKENDS = ("pandas", "csv")
+
+# Values read as missing by pandas.read_csv, the csv backend reads them the same way.
+NA_VALUES = frozenset(
+    {
+        "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+        "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+    }
+)
+# Values read as numbers and booleans by pandas.read_csv.
+INTEGER = re.compile(r"\s*[+-]?\d+\s*")
+FLOAT = re.compile(r"\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*|\s*[+-]?inf(inity)?\s*", re.IGNORECASE)
+BOOLEANS = {"True": True, "TRUE": True, "true": True, "False": False, "FALSE": False, "false": False}
+INT64_MAX = 2**63 - 1
+UINT64_MAX = 2**64 - 1
 
 
 class TwoLevelDataset:
-    def __init__(self, data_source: str, separator: str = ",") -> None:
+    def __init__(
+        self,
+        data_source: str,
+        separator: str = ",",
+        chunksize: int = None,
+        cache: bool = False,
+        stats: Stats = None,
+        backend: str = "pandas",
+    ) -> None:
         """Class to represent a two-level dataset where a primary group
         contains multiple secondary elements, that have a specific set of data.
         For example a series of companies having multiple employees.
@@ -27,51 +68,511 @@ class TwoLevelDataset:
                 },
             },
             ...
-        }"""
-        self._header = (
-            pd.read_csv(data_source, index_col=None, header=None, nrows=1, sep=separator).iloc[0].to_list()
+        }
+
+        If CHUNKSIZE is given the CSV is read in chunks of that many rows,
+        for datasets that would not fit in memory at once.
+
+        BACKEND selects how the CSV is read: "pandas", or "csv" reading it with the csv module
+        without importing pandas, which starts a lot faster. The csv backend converts the values
+        the way pandas infers them (missing values, integers, floats and booleans),
+        but does not support CHUNKSIZE, and needs a single character SEPARATOR.
+
+        If CACHE is True the built dataset is stored next to the CSV (DATA_SOURCE + ".cache"),
+        and loaded from there as long as the CSV and the separator do not change.
+
+        If STATS is given, the duration of reading the CSV (read_csv), of building the dataset
+        from it (build) and of the cache (cache_load, cache_save) are recorded in it,
+        together with the number of rows read, records, primary keys and cache hits."""
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}, expected one of {BACKENDS}")
+        if backend == "csv" and chunksize is not None:
+            raise ValueError("The csv backend does not read in chunks")
+        self._header = []
+        self._store = None
+        self.stats = NULL_STATS if stats is None else stats
+        cache_key = cache_path = None
+        if cache:
+            cache_path = data_source + ".cache"
+            cache_key = self._cache_key(data_source, separator, backend)
+            with self.stats.phase("cache_load"):
+                loaded = self._load_cache(cache_path, cache_key)
+            if loaded:
+                self.stats.count("cache_hits")
+                self._count_records()
+                return
+        if backend == "csv":
+            self._load_csv(data_source, separator)
+        elif chunksize is None:
+            self._load(data_source, separator)
+        else:
+            self._load_chunked(data_source, separator, chunksize)
+        self._count_records()
+        if cache:
+            with self.stats.phase("cache_save"):
+                self._save_cache(cache_path, cache_key)
+
+    def _count_records(self):
+        """Records the number of records and primary keys of the dataset in the stats."""
+        self.stats.count("records", len(self._store.secondaries))
+        self.stats.count("primaries", len(self._store.primaries))
+
+    @staticmethod
+    def _cache_key(data_source: str, separator: str, backend: str) -> tuple:
+        """Returns the key identifying the version of the CSV the cache was built from."""
+        stat = os.stat(data_source)
+        return (
+            CACHE_VERSION,
+            os.path.abspath(data_source),
+            stat.st_size,
+            stat.st_mtime_ns,
+            separator,
+            backend,
+        )
+
+    def _load_cache(self, cache_path: str, cache_key: tuple) -> bool:
+        """Fill the _header and _store attributes from the cache file, if it matches CACHE_KEY.
+
+        The cache is JSON, so a cache file written by someone else can not run code when loaded.
+        Returns True if the cache was loaded."""
+        try:
+            with open(cache_path, encoding="utf-8") as file:
+                # The key is on the first line, so a stale cache is not loaded in whole.
+                if json.loads(file.readline()) != list(cache_key):
+                    return False
+                content = json.loads(file.readline())
+            self._header = content["header"]
+            self._store = ColumnarStore.from_dict(content["store"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def _save_cache(self, cache_path: str, cache_key: tuple):
+        """Write the _header and _store attributes to the cache file.
+
+        Failing to write the cache (e.g. read-only folder) is not an error."""
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as file:
+                file.write(json.dumps(list(cache_key)) + "\n")
+                file.write(json.dumps({"header": self._header, "store": self._store.to_dict()}) + "\n")
+            os.replace(temp_path, cache_path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _load(self, data_source: str, separator: str):
+        """Fill the _store attribute with the data from the dataset, read at once."""
+        # Imported here, pandas takes long to import and is not needed if the cache is used.
+        import pandas as pd
+
+        with self.stats.phase("read_csv"):
+            df = pd.read_csv(data_source, index_col=None, header=0, sep=separator)
+            self._header = self._read_header(data_source, separator)
+        self.stats.count("rows_read", len(df))
+        with self.stats.phase("build"):
+            df = df.sort_values(by=[df.columns[0]], ascending=True, kind="stable").fillna("")
+            primary, secondary, fields = self._split_columns(df)
+            # Only the first occurrence of a contact at a company is kept.
+            unique = ~pd.DataFrame({"p": primary, "s": secondary}).duplicated(keep="first").to_numpy()
+            fields = fields[unique]
+            self._store = ColumnarStore(
+                primary[unique].tolist(),
+                secondary[unique].tolist(),
+                fields.columns.to_list(),
+                [fields.iloc[:, i].to_list() for i in range(fields.shape[1])],
+            )
+
+    def _load_chunked(self, data_source: str, separator: str, chunksize: int):
+        """Fill the _store attribute with the data from the dataset, read in chunks of CHUNKSIZE rows.
+
+        The type of a column depends on all of its values, so the chunks are read as text,
+        twice: first to infer the type of every column (see ColumnType), then to convert
+        the values. Only the first occurrence of every contact is kept in memory, the result
+        is the same as if the whole dataset was read and sorted at once."""
+        with self.stats.phase("read_csv"):
+            self._header = self._read_header(data_source, separator)
+        types = None
+        for chunk in self._read_chunks(data_source, separator, chunksize):
+            with self.stats.phase("build"):
+                if types is None:
+                    types = [ColumnType() for _ in chunk.columns]
+                for column_type, i in zip(types, range(chunk.shape[1])):
+                    column_type.update(chunk.iloc[:, i].to_list())
+
+        first = {}
+        offset = 0
+        for chunk in self._read_chunks(data_source, separator, chunksize):
+            self.stats.count("rows_read", len(chunk))
+            with self.stats.phase("build"):
+                columns = [
+                    column_type.convert(chunk.iloc[:, i].to_list())
+                    for column_type, i in zip(types, range(chunk.shape[1]))
+                ]
+                # Sort key of the rows: missing companies last, then by company, then by position.
+                sort_keys = [
+                    (value is None, "" if value is None else value, offset + i)
+                    for i, value in enumerate(columns[0])
+                ]
+                columns = [["" if value is None else value for value in column] for column in columns]
+                primary = [str(value).title() for value in columns[0]]
+                secondary = [str(value).title() for value in columns[1]]
+                rows = list(zip(*columns[2:]))
+                for i, key in enumerate(zip(primary, secondary)):
+                    if key not in first or sort_keys[i] < first[key][0]:
+                        first[key] = (sort_keys[i], rows[i])
+                offset += len(chunk)
+        with self.stats.phase("build"):
+            names = [str(name).title() for name in self._header[2:]]
+            ordered = sorted(first.items(), key=lambda item: item[1][0])
+            columns = [list(column) for column in zip(*(row for _, (_, row) in ordered))]
+            self._store = ColumnarStore(
+                [primary for (primary, _), _ in ordered],
+                [secondary for (_, secondary), _ in ordered],
+                names,
+                columns or [[] for _ in names],
+            )
+
+    @staticmethod
+    def _read_header(data_source: str, separator: str) -> list:
+        """Returns the column names of the dataset as they are written in its header.
+
+        Unlike the column names of pandas, empty names are kept empty and repeated names are not
+        numbered, so the value of a repeated name is that of its last column (see ColumnarStore)."""
+        import pandas as pd
+
+        header = pd.read_csv(
+            data_source,
+            index_col=None,
+            header=None,
+            nrows=1,
+            sep=separator,
+            dtype=str,
+            keep_default_na=False,
         )
-        self._df = (
-            pd.read_csv(data_source, index_col=None, header=0, sep=separator)
-            .sort_values(by=[self._header[0]], ascending=True)
-            .fillna("")
+        return header.iloc[0].to_list()
+
+    def _read_chunks(self, data_source: str, separator: str, chunksize: int):
+        """Yields the chunks of CHUNKSIZE rows of the dataset, every value read as text."""
+        import pandas as pd
+
+        reader = pd.read_csv(
+            data_source,
+            index_col=None,
+            header=0,
+            sep=separator,
+            chunksize=chunksize,
+            dtype=str,
+            na_filter=False,
         )
-        self._data = {}
-        self._create_dict()
+        with reader:
+            chunks = iter(reader)
+            while True:
+                with self.stats.phase("read_csv"):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
 
-    def _create_dict(self):
-        """Fill the _data attribute with the data from the dataset."""
-        for r in range(len(self._df)):
-            row = self._df.iloc[r]
+    def _load_csv(self, data_source: str, separator: str):
+        """Fill the _store attribute with the data from the dataset, read with the csv module.
 
-            primary = row.iloc[0].title()
-            secondary = row.iloc[1].title()
+        The result is the same as with pandas: the values are converted the way pandas infers
+        the type of the columns, the rows are sorted by the first column, missing values last,
+        and only the first occurrence of a contact at a company is kept."""
+        if len(separator) != 1:
+            raise ValueError("The csv backend needs a single character separator")
+        with self.stats.phase("read_csv"):
+            with open(data_source, newline="", encoding="utf-8-sig") as file:
+                reader = csv.reader(file, delimiter=separator)
+                header = next(reader, None)
+                if header is None:
+                    raise ValueError(f"No columns to parse from file: {data_source}")
+                rows = [row for row in reader if row]
+        self.stats.count("rows_read", len(rows))
+        with self.stats.phase("build"):
+            self._header = header
+            width = len(self._header)
+            columns = [[] for _ in range(width)]
+            for number, row in enumerate(rows, 2):
+                if len(row) > width:
+                    raise ValueError(
+                        f"Expected {width} fields in line {number} of {data_source}, saw {len(row)}"
+                    )
+                row += [""] * (width - len(row))
+                for column, value in zip(columns, row):
+                    column.append(value)
+            types = [ColumnType() for _ in columns]
+            for column_type, column in zip(types, columns):
+                column_type.update(column)
+            columns = [column_type.convert(column) for column_type, column in zip(types, columns)]
 
-            if primary not in self._data:
-                self._data[primary] = {}
-            if secondary not in self._data[primary]:
-                self._data[primary][secondary] = {}
-                for i, col in enumerate(self._header[2:]):
-                    self._data[primary][secondary][col.title()] = row.iloc[i + 2]
+            # Stable sort by the first column, the missing values last.
+            order = sorted(
+                range(len(rows)),
+                key=lambda i: (columns[0][i] is None, "" if columns[0][i] is None else columns[0][i]),
+            )
+            columns = [["" if column[i] is None else column[i] for i in order] for column in columns]
+            primary = [str(value).title() for value in columns[0]]
+            secondary = [str(value).title() for value in columns[1]]
+            keep = []
+            seen = set()
+            for i, key in enumerate(zip(primary, secondary)):
+                if key not in seen:
+                    seen.add(key)
+                    keep.append(i)
+            self._store = ColumnarStore(
+                [primary[i] for i in keep],
+                [secondary[i] for i in keep],
+                [str(name).title() for name in self._header[2:]],
+                [[column[i] for i in keep] for column in columns[2:]],
+            )
 
-    def get_data(self) -> dict:
-        """Returns the whole DataFrame."""
-        return self._data
+    def _split_columns(self, df: "pd.DataFrame") -> tuple:
+        """Returns the title-cased primary and secondary columns of DF as arrays,
+        and the rest of the columns as a DataFrame with title-cased column names."""
+        primary = df.iloc[:, 0].astype(str).str.title().to_numpy()
+        secondary = df.iloc[:, 1].astype(str).str.title().to_numpy()
+        fields = df.iloc[:, 2:]
+        fields.columns = [str(col).title() for col in self._header[2:]]
+        return primary, secondary, fields
+
+    def get_data(self) -> Mapping:
+        """Returns the whole dataset as a read-only nested mapping, in the format
+        described at the class."""
+        return DatasetView(self._store)
 
     def get_primary_list(self) -> list:
-        """Returns the first level keys of the dataset in a list format."""
-        return list(self._data.keys())
+        """Returns the first level keys of the dataset in a list format.
+
+        The list is shared, it should not be modified."""
+        return self._store.primaries
 
-    def get_secondary(self, primary: str) -> dict | None:
+    def get_secondary(self, primary: str) -> Mapping | None:
         """Returns the second level of the dataset belonging to PRIMARY
-        in a dict format.
+        in a read-only mapping format.
 
         PRYMARY being the first level key of the dataset."""
-        return self._data.get(primary)
+        if primary not in self._store.ranges:
+            return None
+        return SecondaryView(self._store, primary)
 
     def get_secondary_list(self, primary: str) -> list:
         """Returns the second level keys of the dataset belonging to PRIMARY
         int a list format.
 
         PRYMARY being the first level key of the dataset."""
-        return list(self.get_secondary(primary).keys())
+        start, stop = self._store.ranges[primary]
+        return self._store.secondaries[start:stop]
+
+
+class ColumnType:
+    def __init__(self) -> None:
+        """Class for inferring the type of a CSV column from its text values the way pandas.read_csv
+        infers it, and converting the values to it. The values can be given in parts, e.g. the
+        chunks of the CSV, as the type depends on all of them.
+
+        The column is read as integers, or floats if some values are missing, as floats,
+        or as booleans if every present value is one, otherwise the text is kept.
+        Integers out of the 64 bit range are kept as text too, like pandas does.
+        """
+        self.present = False
+        self.missing = False
+        self.integer = True
+        self.floating = True
+        self.boolean = True
+        # The range of the integer values (and 0).
+        self.minimum = 0
+        self.maximum = 0
+
+    def update(self, values: list):
+        """Updates the type with the text VALUES of the column."""
+        for value in values:
+            if value in NA_VALUES:
+                self.missing = True
+                continue
+            self.present = True
+            if not (self.integer or self.floating or self.boolean):
+                # Text, the rest of the values do not change that.
+                break
+            if self.integer or self.floating:
+                if INTEGER.fullmatch(value):
+                    number = int(value)
+                    self.minimum = min(self.minimum, number)
+                    self.maximum = max(self.maximum, number)
+                else:
+                    self.integer = False
+                    # Too large numbers are kept as text, not read as infinity.
+                    if self.floating and not (
+                        FLOAT.fullmatch(value)
+                        and (not math.isinf(float(value)) or "inf" in value.lower())
+                    ):
+                        self.floating = False
+            if self.boolean and value not in BOOLEANS:
+                self.boolean = False
+
+    def convert(self, values: list) -> list:
+        """Returns the text VALUES of the column converted to its type, None for the missing ones."""
+        if not self.present:
+            return [None] * len(values)
+        if self.integer:
+            if -INT64_MAX - 1 <= self.minimum and self.maximum <= INT64_MAX:
+                if not self.missing:
+                    return [int(value) for value in values]
+                return [None if value in NA_VALUES else float(int(value)) for value in values]
+            if self.minimum >= 0 and self.maximum <= UINT64_MAX and not self.missing:
+                return [int(value) for value in values]
+        elif self.floating and self.maximum <= UINT64_MAX:
+            return [None if value in NA_VALUES else float(value) for value in values]
+        if self.boolean:
+            return [None if value in NA_VALUES else BOOLEANS[value] for value in values]
+        return [None if value in NA_VALUES else value for value in values]
+
+
+class ColumnarStore:
+    def __init__(self, primary, secondary, names: list, columns: list) -> None:
+        """Class for the columnar storage of a TwoLevelDataset.
+
+        Every record is a row, the value of a field is stored in the list of its column.
+        The rows of a primary key are grouped into a contiguous range of rows.
+        Repeated text values are stored as a single shared object.
+
+        Args:
+            primary: The primary key of every row.
+            secondary: The secondary key of every row, unique within a primary key.
+            names (list): The names of the field columns.
+            columns (list): The list of values of every field column.
+        """
+        # Group the rows by the primary key, keeping the order of the first appearances.
+        groups = {}
+        for row, key in enumerate(primary):
+            groups.setdefault(key, []).append(row)
+        order = [row for rows in groups.values() for row in rows]
+        # The rows are usually grouped already, as the dataset is sorted by the primary key.
+        if order == list(range(len(order))):
+            order = None
+
+        pool = {}
+        self.primaries = [pool.setdefault(key, key) for key in groups]
+        self.ranges = {}
+        stop = 0
+        for key in self.primaries:
+            start, stop = stop, stop + len(groups[key])
+            self.ranges[key] = (start, stop)
+        self.secondaries = self._intern(self._reorder(secondary, order), pool)
+        # Like a dict, a repeated field name keeps the position of the first and the value of the last.
+        self.names = list(dict.fromkeys(names))
+        self.column_index = {name: i for i, name in enumerate(names)}
+        self.columns = [self._intern(self._reorder(column, order), pool) for column in columns]
+        # Secondary key to row lookups of the primary keys, built when first needed.
+        self._rows = {}
+
+    @staticmethod
+    def _reorder(values, order: list):
+        """Returns VALUES in the ORDER of the rows, or as they are if ORDER is None."""
+        return values if order is None else (values[row] for row in order)
+
+    @staticmethod
+    def _intern(values, pool: dict) -> list:
+        """Returns VALUES with every text value replaced by the equal one already in POOL.
+
+        Only text is pooled, as the equal numbers and booleans (1, 1.0, True) are of different types."""
+        return [pool.setdefault(value, value) if type(value) is str else value for value in values]
+
+    def to_dict(self) -> dict:
+        """Returns the content of the store as plain lists, see from_dict."""
+        return {
+            "primaries": self.primaries,
+            "sizes": [stop - start for start, stop in self.ranges.values()],
+            "secondaries": self.secondaries,
+            "names": self.names,
+            # Only the columns in use, of a repeated name that of the last.
+            "columns": [self.columns[self.column_index[name]] for name in self.names],
+        }
+
+    @classmethod
+    def from_dict(cls, content: dict) -> "ColumnarStore":
+        """Returns the store of the CONTENT returned by to_dict.
+
+        Raises ValueError if the lists of CONTENT do not fit together."""
+        primary = [key for key, size in zip(content["primaries"], content["sizes"]) for _ in range(size)]
+        secondaries = content["secondaries"]
+        columns = content["columns"]
+        names = content["names"]
+        if len(names) != len(columns) or any(
+            len(column) != len(primary) for column in (secondaries, *columns)
+        ):
+            raise ValueError("The lists of the store are of different lengths")
+        return cls(primary, secondaries, names, columns)
+
+    def row(self, primary: str, secondary: str) -> int:
+        """Returns the row of the record SECONDARY of PRIMARY, raises KeyError if there is none."""
+        if primary not in self._rows:
+            start, stop = self.ranges[primary]
+            self._rows[primary] = {
+                key: start + i for i, key in enumerate(self.secondaries[start:stop])
+            }
+        return self._rows[primary][secondary]
+
+
+class DatasetView(Mapping):
+    __slots__ = ("_store",)
+
+    def __init__(self, store: ColumnarStore) -> None:
+        """Read-only mapping of the primary keys to their SecondaryView."""
+        self._store = store
+
+    def __getitem__(self, primary: str) -> "SecondaryView":
+        if primary not in self._store.ranges:
+            raise KeyError(primary)
+        return SecondaryView(self._store, primary)
+
+    def __iter__(self):
+        return iter(self._store.primaries)
+
+    def __len__(self) -> int:
+        return len(self._store.primaries)
+
+    def __contains__(self, primary) -> bool:
+        return primary in self._store.ranges
+
+
+class SecondaryView(Mapping):
+    __slots__ = ("_store", "_primary")
+
+    def __init__(self, store: ColumnarStore, primary: str) -> None:
+        """Read-only mapping of the secondary keys of PRIMARY to their Record."""
+        self._store = store
+        self._primary = primary
+
+    def __getitem__(self, secondary: str) -> "Record":
+        return Record(self._store, self._store.row(self._primary, secondary))
+
+    def __iter__(self):
+        start, stop = self._store.ranges[self._primary]
+        return iter(self._store.secondaries[start:stop])
+
+    def __len__(self) -> int:
+        start, stop = self._store.ranges[self._primary]
+        return stop - start
+
+
+class Record(Mapping):
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store: ColumnarStore, row: int) -> None:
+        """Read-only mapping of the field names to the values of a single record."""
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, name: str):
+        return self._store.columns[self._store.column_index[name]][self._row]
+
+    def __iter__(self):
+        return iter(self._store.names)
+
+    def __len__(self) -> int:
+        return len(self._store.names)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
@@ -0,0 +1,96 @@
+import copy
+import struct
+import zipfile
+
+import docx.document
+from docx.opc.pkgwriter import _ContentTypesItem
+
+
+CONTENT_TYPES_MEMBER = "[Content_Types].xml"
+
+# Size of the chunks the raw data of the copied members is read in.
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def write_docx(document: docx.document.Document, source, target, partnames: set):
+    """Writes DOCUMENT as a .docx to TARGET, copying the untouched members of SOURCE.
+
+    Only the parts named in PARTNAMES (e.g. "/word/document.xml") are serialized again,
+    together with the parts added to the document since it was read from SOURCE.
+    Every other zip member of SOURCE is copied raw, without decompressing and recompressing it.
+
+    Args:
+        document (docx.document.Document): The document read from SOURCE.
+        source: Path or binary file-like object of the .docx the document was read from.
+        target: Path or writable binary file-like object to write the .docx to,
+            it does not need to be seekable.
+        partnames (set): Names of the parts that were modified.
+    """
+    parts = {str(part.partname): part for part in document.part.package.iter_parts()}
+    with zipfile.ZipFile(source) as source_zip:
+        members = {"/" + info.filename for info in source_zip.infolist()}
+        new_parts = {name for name in parts if name not in members}
+        rewrite = set(partnames) | new_parts
+        # Parts referencing the added parts have changed relationships.
+        for name, part in parts.items():
+            for rel in part.rels.values():
+                if not rel.is_external and str(rel.target_part.partname) in new_parts:
+                    rewrite.add(name)
+        rewrite_rels = {str(parts[name].partname.rels_uri): name for name in rewrite if name in parts}
+
+        with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as target_zip:
+            for info in source_zip.infolist():
+                name = "/" + info.filename
+                if info.filename == CONTENT_TYPES_MEMBER and new_parts:
+                    target_zip.writestr(
+                        CONTENT_TYPES_MEMBER, _ContentTypesItem.from_parts(parts.values()).blob
+                    )
+                elif name in rewrite_rels:
+                    _write_rels(target_zip, parts[rewrite_rels.pop(name)])
+                elif name in rewrite and name in parts:
+                    _write_part(target_zip, parts[name])
+                    rewrite.discard(name)
+                else:
+                    _copy_member(source_zip, info, target_zip)
+            for name in sorted(rewrite & set(parts)):
+                _write_part(target_zip, parts[name])
+            for name in rewrite_rels.values():
+                _write_rels(target_zip, parts[name])
+
+
+def _write_part(target_zip: zipfile.ZipFile, part):
+    """Writes the serialized PART to TARGET_ZIP."""
+    target_zip.writestr(part.partname.membername, part.blob)
+
+
+def _write_rels(target_zip: zipfile.ZipFile, part):
+    """Writes the relationships of PART to TARGET_ZIP, if it has any."""
+    if len(part.rels):
+        target_zip.writestr(part.partname.rels_uri.membername, part.rels.xml)
+
+
+def _copy_member(source_zip: zipfile.ZipFile, info: zipfile.ZipInfo, target_zip: zipfile.ZipFile):
+    """Copies the compressed data of the member INFO from SOURCE_ZIP to TARGET_ZIP as it is."""
+    source_zip.fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, source_zip.fp.read(zipfile.sizeFileHeader))
+    name_length = header[zipfile._FH_FILENAME_LENGTH]
+    extra_length = header[zipfile._FH_EXTRA_FIELD_LENGTH]
+    source_zip.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+    copied = copy.copy(info)
+    # The sizes and the CRC are known up front, so no data descriptor is needed after the data.
+    copied.flag_bits &= ~zipfile._MASK_USE_DATA_DESCRIPTOR
+    copied.extra = zipfile._strip_extra(info.extra, (1,))
+    copied.header_offset = target_zip.fp.tell()
+    target_zip.fp.write(copied.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        chunk = source_zip.fp.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data of member {info.filename}")
+        target_zip.fp.write(chunk)
+        remaining -= len(chunk)
+    target_zip.filelist.append(copied)
+    target_zip.NameToInfo[copied.filename] = copied
+    target_zip.start_dir = target_zip.fp.tell()
+    target_zip._didModify = True
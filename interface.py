@@ -1,17 +1,34 @@
 import os
 import datetime
 import tkinter as tk
-from tkinter import filedialog
+from tkinter import filedialog, ttk
 
+from batch import FILENAME_PATTERN, fields_to_templates, output_filename, record_fields
 from data import TwoLevelDataset
-from templating import Templating
+from render_queue import CancelledError, RenderQueue
+from search import SubstringIndex
 
 
 IMG_PATH = os.path.join("", "data", "logo.png")
 
+# Delay in ms after the last keystroke in a filter field before the list is refreshed.
+FILTER_DELAY = 100
+# Interval in ms of checking for finished renders.
+RENDER_POLL_INTERVAL = 100
+
 
 class Gui(tk.Tk):
-    def __init__(self, data_source: str, separator: str, template_start: str, template_end: str, *args, **kwargs):
+    def __init__(
+        self,
+        data_source: str,
+        separator: str,
+        template_start: str,
+        template_end: str,
+        *args,
+        data_cache: bool = False,
+        data_backend: str = "pandas",
+        **kwargs,
+    ):
         """Class for the GUI of a templating app.
 
         It creates a document based on a template input which is filled out
@@ -25,6 +42,11 @@ class Gui(tk.Tk):
         self.template_start = template_start
         self.template_end = template_end
         self.template = {}
+        self.fields = {}
+        # Documents are rendered in the background, the counts are for the progress bar.
+        self.render_queue = RenderQueue(template_start, template_end)
+        self.renders_submitted = 0
+        self.renders_finished = 0
 
         # Set up canvas for the logo.
         self.canvas = tk.Canvas(self, width=100, height=100)
@@ -74,7 +96,10 @@ class Gui(tk.Tk):
         # Setup a frame with label, entry and listfield for the companies.
         self.company_frame = tk.Frame(self.main_frame, borderwidth=2, relief="groove")
         self.company_filter_label = tk.Label(self.company_frame, text="Company filter:")
-        self.company_filter_field = tk.Entry(self.company_frame, width=36)
+        self.company_filter = tk.StringVar()
+        self.company_filter_field = tk.Entry(
+            self.company_frame, width=36, textvariable=self.company_filter
+        )
         self.company_yscrollbar = tk.Scrollbar(self.company_frame, orient="vertical")
         self.company_list = tk.Listbox(
             self.company_frame, yscrollcommand=self.company_yscrollbar.set, width=50
@@ -90,7 +115,10 @@ class Gui(tk.Tk):
         # Setup a frame with label, entry and listfield for the contacts.
         self.contact_frame = tk.Frame(self.main_frame, borderwidth=2, relief="groove")
         self.contact_filter_label = tk.Label(self.contact_frame, text="Contact filter:")
-        self.contact_filter_field = tk.Entry(self.contact_frame, width=36)
+        self.contact_filter = tk.StringVar()
+        self.contact_filter_field = tk.Entry(
+            self.contact_frame, width=36, textvariable=self.contact_filter
+        )
         self.contact_yscrollbar = tk.Scrollbar(self.contact_frame, orient="vertical")
         self.contact_list = tk.Listbox(
             self.contact_frame, yscrollcommand=self.contact_yscrollbar.set, width=50
@@ -112,6 +140,12 @@ class Gui(tk.Tk):
         self.generate_button = tk.Button(
             self.export_frame, text="Generate", command=self._generate_document, state="disabled"
         )
+        self.cancel_button = tk.Button(
+            self.export_frame, text="Cancel", command=self._cancel_renders, state="disabled"
+        )
+        self.progress = ttk.Progressbar(self.export_frame, length=300, mode="determinate")
+        self.progress_text = tk.StringVar()
+        self.progress_label = tk.Label(self.export_frame, textvariable=self.progress_text)
         self.notification = tk.StringVar()
         self.notification_label = tk.Label(self.export_frame, textvariable=self.notification)
         self.message = tk.StringVar()
@@ -119,12 +153,17 @@ class Gui(tk.Tk):
 
         self.export_frame.pack(pady=25)
         self.generate_button.pack(pady=5)
+        self.cancel_button.pack(pady=5)
+        self.progress.pack(pady=5)
+        self.progress_label.pack(pady=5)
         self.notification_label.pack(pady=5)
         self.message_label.pack(pady=5)
 
         # Load the dataset.
         try:
-            self.data = TwoLevelDataset(data_source, separator)
+            self.data = TwoLevelDataset(
+                data_source, separator, cache=data_cache, backend=data_backend
+            )
         except FileNotFoundError:
             self.input_file_button.config(state="disabled")
             self.output_folder_button.config(state="disabled")
@@ -132,12 +171,15 @@ class Gui(tk.Tk):
             self.message.set(f"Data for templating not found, please check if the correct CSV exists: {data_source}")
         else:
             self.companies = self.data.get_primary_list()
-            self.companies_filter = None
+            self.company_index = SubstringIndex(self.companies)
             self.selected_company = None
             self.contacts = []
-            self.contacts_filter = None
+            self.contact_index = SubstringIndex(self.contacts)
             self.selected_contact = None
-            self._on_tick()
+            self.pending_filters = {}
+            self.company_filter.trace_add("write", lambda *_: self._schedule_filter("company"))
+            self.contact_filter.trace_add("write", lambda *_: self._schedule_filter("contact"))
+            self._filter_companies()
 
     def _generate_template(self, labels: dict):
         """Create and display the templates loaded from the dataset
@@ -169,7 +211,8 @@ class Gui(tk.Tk):
         if selection:  # Check if a selection has been made
             self.selected_company = self.company_list.get(selection)
             self.contacts = self.data.get_secondary_list(self.selected_company)
-            self.contacts_filter = None
+            self.contact_index = SubstringIndex(self.contacts)
+            self._filter_contacts()
 
     def _contact_selected(self, event):
         """If a contact is selected, create the template according the data in the dataset."""
@@ -183,6 +226,7 @@ class Gui(tk.Tk):
             template.update(self.data.get_data()[self.selected_company][self.selected_contact])
             if "Date" not in template:
                 template["Date"] = datetime.date.today().isoformat()
+            self.fields = template
             self._generate_template(template)
 
     def _open_template(self):
@@ -202,40 +246,84 @@ class Gui(tk.Tk):
             self.generate_button.config(state="normal")
 
     def _generate_document(self):
-        """Generate the document with the templating."""
+        """Queue the render of the document for the selected contact in the background.
+
+        The loops of the template are repeated for every contact of the selected company.
+        The file is named after the contact, so queued renders do not overwrite each other."""
         try:
-            document = Templating(
-                self.get_input_file(),
-                self.get_output_folder(),
-                self.template_start,
-                self.template_end,
-                self.template_to_dict()
-                )
+            input_file = self.get_input_file()
+            output_folder = self.get_output_folder()
         except FileNotFoundError as err:
             self.notification.set("Error:")
             self.message.set(err)
-        document.sub_templates()
-        self.notification.set("Templated document successfully created at:")
-        self.message.set(f"{document.save()}")
-
-    def _on_tick(self):
-        """Periodically refreshes the elements of company_list and contact_list
-        based on the filter fields."""
-        if self.company_filter_field.get() != self.companies_filter:
-            self.companies_filter = self.company_filter_field.get().lower()
-            self.company_list.delete(0, "end")
-            for company in self.companies:
-                if self.companies_filter in company.lower():
-                    self.company_list.insert("end", company)
-
-        if self.contact_filter_field.get() != self.contacts_filter:
-            self.contacts_filter = self.contact_filter_field.get().lower()
-            self.contact_list.delete(0, "end")
-            for contact in self.contacts:
-                if self.contacts_filter in contact.lower():
-                    self.contact_list.insert("end", contact)
-
-        self.after(250, self._on_tick)
+            return
+        save_path = os.path.join("", output_folder, output_filename(FILENAME_PATTERN, self.fields))
+        records = [
+            fields_to_templates(record_fields(self.data, self.selected_company, contact))
+            for contact in self.data.get_secondary_list(self.selected_company)
+        ]
+        self.render_queue.submit(input_file, save_path, self.template_to_dict(), records)
+        if self.renders_submitted == self.renders_finished:
+            # Nothing is running, start counting the progress from zero.
+            self.renders_submitted = self.renders_finished = 0
+            self.after(RENDER_POLL_INTERVAL, self._poll_renders)
+        self.renders_submitted += 1
+        self.cancel_button.config(state="normal")
+        self._update_progress()
+
+    def _cancel_renders(self):
+        """Cancel the queued renders and the one running."""
+        self.render_queue.cancel()
+
+    def _poll_renders(self):
+        """Collect the finished renders from the render queue, while there are renders running."""
+        while not self.render_queue.results.empty():
+            _, save_path, error = self.render_queue.results.get()
+            self.renders_finished += 1
+            if error is None:
+                self.notification.set("Templated document successfully created at:")
+                self.message.set(f"{save_path}")
+            elif isinstance(error, CancelledError):
+                self.notification.set("Cancelled:")
+                self.message.set(f"{save_path}")
+            else:
+                self.notification.set("Error:")
+                self.message.set(f"{save_path}: {error}")
+        self._update_progress()
+        if self.renders_finished < self.renders_submitted:
+            self.after(RENDER_POLL_INTERVAL, self._poll_renders)
+        else:
+            self.cancel_button.config(state="disabled")
+
+    def _update_progress(self):
+        """Show the number of finished renders out of the renders submitted since the queue was empty."""
+        self.progress.config(maximum=max(self.renders_submitted, 1), value=self.renders_finished)
+        self.progress_text.set(f"{self.renders_finished} / {self.renders_submitted} documents")
+
+    def _schedule_filter(self, name: str):
+        """Refresh the company or contact list (NAME) once the filter field
+        has not changed for FILTER_DELAY ms."""
+        if name in self.pending_filters:
+            self.after_cancel(self.pending_filters[name])
+        refresh = self._filter_companies if name == "company" else self._filter_contacts
+        self.pending_filters[name] = self.after(FILTER_DELAY, refresh)
+
+    def _filter_companies(self):
+        """Refill the company_list with the companies matching the filter field."""
+        self.pending_filters.pop("company", None)
+        self._fill_list(self.company_list, self.company_index.search(self.company_filter.get()))
+
+    def _filter_contacts(self):
+        """Refill the contact_list with the contacts matching the filter field."""
+        self.pending_filters.pop("contact", None)
+        self._fill_list(self.contact_list, self.contact_index.search(self.contact_filter.get()))
+
+    @staticmethod
+    def _fill_list(listbox: tk.Listbox, items: list):
+        """Replace the items of LISTBOX with ITEMS in a single call."""
+        listbox.delete(0, "end")
+        if items:
+            listbox.insert("end", *items)
 
     def get_input_file(self) -> str | None:
         """Returns the path for the input file."""
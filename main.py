@@ -1,15 +1,28 @@
 import os
 
-import interface
-
 # Path for CSV containing the data for the templating.
 DATA_SOURCE = os.path.join("", "data", "data.csv")
 DATA_SEPARATOR = ","
+# Keep a cache of the parsed CSV next to it, rebuilt only when the CSV changes.
+DATA_CACHE = True
+# Read the CSV with the csv module ("csv"), starting without importing pandas,
+# or with pandas ("pandas"), which is faster for very large datasets.
+DATA_BACKEND = "csv"
 
 # Setup for the template markers in the template file. Regex pattern.
 TEMPLATE_START = "\[\["
 TEMPLATE_END = "]]"
 
 if __name__ == "__main__":
-    app = interface.Gui(DATA_SOURCE, DATA_SEPARATOR, TEMPLATE_START, TEMPLATE_END)
+    # Imported here, so the settings can be imported without Tk (e.g. by cli.py).
+    import interface
+
+    app = interface.Gui(
+        DATA_SOURCE,
+        DATA_SEPARATOR,
+        TEMPLATE_START,
+        TEMPLATE_END,
+        data_cache=DATA_CACHE,
+        data_backend=DATA_BACKEND,
+    )
     app.mainloop()
@@ -0,0 +1,8 @@
+# The choices of the rendering options, kept apart from templating.py so the command line
+# can offer them without importing python-docx and lxml.
+
+# The ways the paragraphs of the document can be indexed, see Templating.
+ENGINES = ("docx", "lxml")
+
+# The ways the records of a combined document can be separated, see CompiledTemplate.render_combined.
+SEPARATORS = ("page", "section")
@@ -0,0 +1,78 @@
+import os
+import queue
+import threading
+import typing
+
+if typing.TYPE_CHECKING:
+    from templating import CompiledTemplate
+
+
+class RenderQueue:
+    def __init__(self, template_start: str = "\[", template_end: str = "]") -> None:
+        """Class for rendering documents on a background thread, in the order they are submitted.
+
+        The outcome of every job is put on the results queue as a (job_id, path, error) tuple,
+        error being None on success, so it can be collected from another thread (e.g. the Tk loop).
+        The last parsed template is kept, and only parsed again if the file changes.
+        python-docx is only imported when the first job is rendered.
+
+        Args:
+            template_start (str, optional): Regex pattern for the template start designator. Defaults to "\[".
+            template_end (str, optional): Regex pattern for the template end designator. Defaults to "]".
+        """
+        self.template_start = template_start
+        self.template_end = template_end
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.last_id = 0
+        # Jobs with an id up to this one are cancelled.
+        self.cancelled_id = 0
+        self.compiled_templates = {}
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, input_file: str, output_path: str, templates: dict, records: list = None) -> int:
+        """Queues the render of INPUT_FILE with TEMPLATES to OUTPUT_PATH,
+        repeating the loops of the template for the RECORDS if given.
+
+        Returns the id of the job."""
+        self.last_id += 1
+        self.jobs.put((self.last_id, input_file, output_path, templates, records))
+        return self.last_id
+
+    def cancel(self):
+        """Cancels every job submitted so far. A render already running is not saved."""
+        self.cancelled_id = self.last_id
+
+    def _run(self):
+        """Renders the submitted jobs one after the other."""
+        while True:
+            job_id, input_file, output_path, templates, records = self.jobs.get()
+            if job_id <= self.cancelled_id:
+                self.results.put((job_id, output_path, CancelledError("cancelled")))
+                continue
+            try:
+                template = self._compile_template(input_file)
+                document = template.render(templates, records=records)
+                if job_id <= self.cancelled_id:
+                    raise CancelledError("cancelled")
+                template.save(document, output_path)
+            except Exception as err:
+                self.results.put((job_id, output_path, err))
+            else:
+                self.results.put((job_id, output_path, None))
+
+    def _compile_template(self, input_file: str) -> "CompiledTemplate":
+        """Returns the parsed template for INPUT_FILE, only parsing it again if the file changed."""
+        from templating import CompiledTemplate
+
+        key = (input_file, os.path.getmtime(input_file))
+        if key not in self.compiled_templates:
+            self.compiled_templates = {
+                key: CompiledTemplate(input_file, self.template_start, self.template_end)
+            }
+        return self.compiled_templates[key]
+
+
+class CancelledError(Exception):
+    """Raised for the jobs of a RenderQueue that were cancelled."""
@@ -0,0 +1,71 @@
+from array import array
+
+
+# Length of the n-grams the index is built from.
+NGRAM = 3
+
+
+class SubstringIndex:
+    def __init__(self, names: list) -> None:
+        """Class for case-insensitive substring search over a list of names.
+
+        Every trigram of the lowercased names is mapped to the positions of the names
+        containing it, so a query only checks the names having all of its trigrams.
+        The trigram index is built at the first query long enough to use it.
+        If a query extends the previous one, only the previous results are checked.
+
+        Args:
+            names (list): The names to search in, the results keep their order.
+        """
+        self.names = names
+        self.lowered = [name.lower() for name in names]
+        self.postings = None
+        self._last_query = ""
+        self._last_result = range(len(names))
+
+    def search(self, query: str) -> list:
+        """Returns the names containing QUERY, ignoring the case."""
+        return [self.names[i] for i in self.search_positions(query)]
+
+    def search_positions(self, query: str):
+        """Returns the positions of the names containing QUERY, ignoring the case."""
+        query = query.lower()
+        if not query:
+            result = range(len(self.names))
+        elif self._last_query and self._last_query in query:
+            # Every name containing the query contains the previous query too.
+            result = self._filter(self._last_result, query)
+        elif len(query) >= NGRAM:
+            result = self._filter(self._candidates(query), query)
+        else:
+            result = self._filter(range(len(self.names)), query)
+        self._last_query = query
+        self._last_result = result
+        return result
+
+    def _build_postings(self):
+        """Maps every trigram to the positions of the names containing it."""
+        self.postings = {}
+        for i, name in enumerate(self.lowered):
+            for ngram in {name[j : j + NGRAM] for j in range(len(name) - NGRAM + 1)}:
+                if ngram not in self.postings:
+                    self.postings[ngram] = array("I")
+                self.postings[ngram].append(i)
+
+    def _candidates(self, query: str):
+        """Returns the positions of the names containing every trigram of QUERY."""
+        if self.postings is None:
+            self._build_postings()
+        ngrams = {query[j : j + NGRAM] for j in range(len(query) - NGRAM + 1)}
+        postings = sorted((self.postings.get(ngram, ()) for ngram in ngrams), key=len)
+        candidates = set(postings[0])
+        for positions in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(positions)
+        return sorted(candidates)
+
+    def _filter(self, positions, query: str) -> list:
+        """Returns the POSITIONS of the names containing QUERY."""
+        lowered = self.lowered
+        return [i for i in positions if query in lowered[i]]
@@ -0,0 +1,306 @@
+import argparse
+import base64
+import binascii
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from main import TEMPLATE_END, TEMPLATE_START
+from templating import ENGINES, CompiledTemplate
+
+
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Largest request body accepted, in bytes.
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+# Templates are identified by the SHA-256 hex digest of their content.
+TEMPLATE_ID = re.compile("[0-9a-f]{64}")
+
+
+class TemplateCache:
+    def __init__(
+        self,
+        maxsize: int = 32,
+        template_start: str = "\[",
+        template_end: str = "]",
+        engine: str = "docx",
+    ) -> None:
+        """Class for a least recently used cache of CompiledTemplates, keyed by the SHA-256
+        hash of the content of the template, so a template is parsed once while it is in use.
+
+        Args:
+            maxsize (int, optional): Number of templates kept. Defaults to 32.
+            template_start (str, optional): Regex pattern for the template start designator. Defaults to "\[".
+            template_end (str, optional): Regex pattern for the template end designator. Defaults to "]".
+            engine (str, optional): How the templates are indexed, see Templating. Defaults to "docx".
+        """
+        self.maxsize = maxsize
+        self.template_start = template_start
+        self.template_end = template_end
+        self.engine = engine
+        self.templates = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, template_id: str, load) -> CompiledTemplate:
+        """Returns the compiled template of TEMPLATE_ID, compiling the content returned
+        by LOAD() if it is not in the cache."""
+        with self.lock:
+            if template_id in self.templates:
+                self.templates.move_to_end(template_id)
+                return self.templates[template_id]
+        template = CompiledTemplate(load(), self.template_start, self.template_end, self.engine)
+        with self.lock:
+            self.templates[template_id] = template
+            self.templates.move_to_end(template_id)
+            while len(self.templates) > self.maxsize:
+                self.templates.popitem(last=False)
+        return template
+
+
+# The uploaded templates are stored in the spool folder, named after their hash,
+# every worker process compiles them into its own cache.
+_spool_dir = None
+_cache = None
+
+
+def _init_worker(spool_dir: str, cache_size: int, template_start: str, template_end: str, engine: str):
+    """Sets up the template cache of the worker process."""
+    global _spool_dir, _cache
+    _spool_dir = spool_dir
+    _cache = TemplateCache(cache_size, template_start, template_end, engine)
+
+
+def _read_template(template_id: str) -> bytes:
+    """Returns the content of the uploaded template TEMPLATE_ID."""
+    with open(os.path.join(_spool_dir, f"{template_id}.docx"), "rb") as file:
+        return file.read()
+
+
+def _render(
+    template_id: str, templates: dict, records: list = None, content: bytes = None
+) -> bytes:
+    """Renders the template TEMPLATE_ID with TEMPLATES in the worker process,
+    repeating its loops for the RECORDS if given.
+
+    The template is compiled from its CONTENT if given, otherwise from the spool folder."""
+    template = _cache.get(
+        template_id, lambda: _read_template(template_id) if content is None else content
+    )
+    return template.render_bytes(templates, records=records)
+
+
+class RenderService:
+    def __init__(
+        self,
+        workers: int = None,
+        cache_size: int = 32,
+        template_start: str = "\[",
+        template_end: str = "]",
+        engine: str = "docx",
+        spool_dir: str = None,
+    ) -> None:
+        """Class for rendering uploaded templates on a pool of worker processes.
+
+        Templates are identified by the SHA-256 hash of their content. Every worker keeps
+        an LRU cache of CACHE_SIZE compiled templates, so hot templates are not parsed again.
+
+        Args:
+            workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+            cache_size (int, optional): Number of compiled templates cached per worker. Defaults to 32.
+            template_start (str, optional): Regex pattern for the template start designator. Defaults to "\[".
+            template_end (str, optional): Regex pattern for the template end designator. Defaults to "]".
+            engine (str, optional): How the templates are indexed, see Templating. Defaults to "docx".
+            spool_dir (str, optional): Folder to store the uploaded templates in.
+                Defaults to a new temporary folder, removed on shutdown.
+        """
+        # Only the temporary folder created here is removed on shutdown, a given one is kept.
+        self.remove_spool_dir = spool_dir is None
+        self.spool_dir = spool_dir or tempfile.mkdtemp(prefix="docx_templates_")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(self.spool_dir, cache_size, template_start, template_end, engine),
+        )
+
+    @staticmethod
+    def template_id(content: bytes) -> str:
+        """Returns the id of the template CONTENT.
+
+        Raises ValueError if CONTENT is not a .docx (zip) file."""
+        if not zipfile.is_zipfile(io.BytesIO(content)):
+            raise ValueError("The template is not a .docx file")
+        return hashlib.sha256(content).hexdigest()
+
+    def add_template(self, content: bytes) -> str:
+        """Stores the template CONTENT, returns its id.
+
+        Raises ValueError if CONTENT is not a .docx (zip) file."""
+        template_id = self.template_id(content)
+        path = self.template_path(template_id)
+        if not os.path.exists(path):
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as file:
+                file.write(content)
+            os.replace(temp_path, path)
+        return template_id
+
+    def has_template(self, template_id: str) -> bool:
+        """True if the template TEMPLATE_ID was uploaded."""
+        return bool(TEMPLATE_ID.fullmatch(template_id)) and os.path.exists(
+            self.template_path(template_id)
+        )
+
+    def template_path(self, template_id: str) -> str:
+        """Returns the path of the stored template TEMPLATE_ID."""
+        return os.path.join(self.spool_dir, f"{template_id}.docx")
+
+    def render(
+        self, template_id: str, templates: dict, records: list = None, content: bytes = None
+    ) -> bytes:
+        """Returns the .docx content of the template TEMPLATE_ID rendered with TEMPLATES,
+        repeating its loops for the RECORDS if given.
+
+        The CONTENT of a template sent inline is passed to the worker instead of being stored,
+        its cache is keyed by the id all the same."""
+        return self.executor.submit(_render, template_id, templates, records, content).result()
+
+    def shutdown(self):
+        """Stops the worker processes, and removes the temporary spool folder."""
+        self.executor.shutdown()
+        if self.remove_spool_dir:
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """Handles the requests of the render server:
+
+    POST /templates with the .docx as the body stores the template,
+    and responds with {"template_id": ...}.
+
+    POST /render with a JSON body {"template_id": ..., "values": {...}} responds with the
+    rendered .docx. Instead of "template_id" the template can be sent as base64 in "template".
+    An optional "records": [{...}, ...] list repeats the loops of the template for every record."""
+
+    service: RenderService = None
+
+    def do_POST(self):
+        if self.path not in ("/templates", "/render"):
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        # Only the errors of reading and validating the request are the fault of the client.
+        try:
+            body = self._read_body()
+            if self.path == "/templates":
+                self._send_json(200, {"template_id": self.service.add_template(body)})
+                return
+            template_id, content, values, records = self._parse_render_request(json.loads(body))
+        except (ValueError, KeyError, TypeError, binascii.Error) as err:
+            self._send_json(400, {"error": f"{type(err).__name__}: {err}"})
+            return
+        except Exception as err:
+            self._send_json(500, {"error": f"{type(err).__name__}: {err}"})
+            return
+        if content is None and not self.service.has_template(template_id):
+            self._send_json(404, {"error": f"Unknown template: {template_id}"})
+            return
+        try:
+            content = self.service.render(template_id, values, records, content)
+        except Exception as err:
+            self._send_json(500, {"error": f"{type(err).__name__}: {err}"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", DOCX_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("X-Template-Id", template_id)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _parse_render_request(self, request: dict) -> tuple:
+        """Returns the template id, the content of the template if it is sent inline (None if
+        it was uploaded), the values and the records of the render REQUEST.
+
+        Raises TypeError, KeyError, ValueError or binascii.Error if REQUEST is not valid."""
+        if not isinstance(request, dict):
+            raise TypeError("The request must be a JSON object")
+        values = request.get("values", {})
+        if not isinstance(values, dict):
+            raise TypeError('"values" must be an object')
+        records = request.get("records")
+        if records is not None and not (
+            isinstance(records, list) and all(isinstance(record, dict) for record in records)
+        ):
+            raise TypeError('"records" must be a list of objects')
+        if "template" in request:
+            template = request["template"]
+            if not isinstance(template, str):
+                raise TypeError('"template" must be a base64 string')
+            content = base64.b64decode(template, validate=True)
+            template_id = self.service.template_id(content)
+        else:
+            content = None
+            template_id = request["template_id"]
+            if not isinstance(template_id, str):
+                raise TypeError('"template_id" must be a string')
+        return template_id, content, values, records
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_REQUEST_SIZE:
+            raise ValueError(f"Request body larger than {MAX_REQUEST_SIZE} bytes")
+        return self.rfile.read(length)
+
+    def _send_json(self, status: int, content: dict):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main(argv: list = None):
+    """Runs the render server until interrupted."""
+    parser = argparse.ArgumentParser(description="Local HTTP server rendering .docx templates.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument(
+        "--cache-size", type=int, default=32, help="compiled templates cached per worker"
+    )
+    parser.add_argument(
+        "--start", default=TEMPLATE_START, help="regex pattern of the template start designator"
+    )
+    parser.add_argument(
+        "--end", default=TEMPLATE_END, help="regex pattern of the template end designator"
+    )
+    parser.add_argument("--engine", choices=ENGINES, default="docx", help="templating engine")
+    parser.add_argument("--spool-dir", default=None, help="folder to store the uploaded templates")
+    args = parser.parse_args(argv)
+
+    RenderRequestHandler.service = RenderService(
+        args.workers, args.cache_size, args.start, args.end, args.engine, args.spool_dir
+    )
+    server = ThreadingHTTPServer((args.host, args.port), RenderRequestHandler)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        RenderRequestHandler.service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import contextlib
+import json
+import logging
+import time
+
+
+class Stats:
+    def __init__(self, callback=None) -> None:
+        """Class for collecting the durations of the processing phases and the counts of the
+        processed items (paragraphs, runs, substitutions, rows, ...).
+
+        Templating, CompiledTemplate and TwoLevelDataset record into it when given one,
+        otherwise nothing is measured.
+
+        Args:
+            callback (optional): Called with the name and the duration in seconds of every
+                phase as it finishes. Defaults to None.
+        """
+        self.callback = callback
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+
+    @property
+    def enabled(self) -> bool:
+        """True if the measurements are recorded, counting that is costly is skipped otherwise."""
+        return True
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Context manager measuring the duration of the phase NAME.
+
+        The durations of the repeated phases are summed up."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.callback:
+                self.callback(name, seconds)
+
+    def count(self, name: str, amount: int = 1):
+        """Adds AMOUNT to the counter NAME."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def merge(self, other):
+        """Adds the measurements of OTHER, a Stats or its to_dict, to these ones.
+
+        Used to aggregate the stats of many renders, e.g. of a batch run."""
+        if isinstance(other, Stats):
+            other = other.to_dict()
+        for name, phase in other["phases"].items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + phase["seconds"]
+            self.calls[name] = self.calls.get(name, 0) + phase["calls"]
+        for name, amount in other["counters"].items():
+            self.count(name, amount)
+
+    def to_dict(self) -> dict:
+        """Returns the measurements as a JSON serializable dict:
+        {"phases": {name: {"seconds": ..., "calls": ...}}, "counters": {name: ...}}"""
+        return {
+            "phases": {
+                name: {"seconds": seconds, "calls": self.calls[name]}
+                for name, seconds in self.seconds.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+    def log(self, logger: logging.Logger = None, level: int = logging.INFO, **context):
+        """Logs the measurements as a single JSON line, together with the CONTEXT fields
+        (e.g. the template or the record), so they can be aggregated from the logs."""
+        logger = logger or logging.getLogger(__name__)
+        logger.log(level, json.dumps({**context, **self.to_dict()}, ensure_ascii=False))
+
+
+class NullStats(Stats):
+    """Stats that records nothing, used when no Stats is given."""
+
+    @property
+    def enabled(self) -> bool:
+        return False
+
+    def phase(self, name: str):
+        return contextlib.nullcontext()
+
+    def count(self, name: str, amount: int = 1):
+        pass
+
+
+# Shared instance for the classes created without a Stats.
+NULL_STATS = NullStats()
@@ -1,151 +1,707 @@
+import bisect
+import copy
+import io
+import itertools
 import os
 import re
 
 import docx
+import docx.document
+import docx.table
+import docx.text.paragraph
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import nsdecls, nsmap, qn
+from lxml import etree
+
+from docx_writer import write_docx
+from options import ENGINES, SEPARATORS
+from stats import NULL_STATS, Stats
+
+
+# Precompiled XPath expressions for the lxml engine.
+XPATH_PARAGRAPHS = etree.XPath(".//w:p", namespaces=nsmap)
+XPATH_TEXTBOX_PARAGRAPHS = etree.XPath(".//w:txbxContent//w:p", namespaces=nsmap)
+XPATH_RUNS = etree.XPath("./w:r", namespaces=nsmap)
+XPATH_RUN_CONTENT = etree.XPath(
+    "w:br | w:cr | w:noBreakHyphen | w:ptab | w:t | w:tab", namespaces=nsmap
+)
+XPATH_CELLS = etree.XPath(".//w:tc", namespaces=nsmap)
+XPATH_DRAWING_IDS = etree.XPath(".//wp:docPr", namespaces=nsmap)
+
+# Paragraph holding a page break, put between the records of a combined document.
+PAGE_BREAK = parse_xml(f'<w:p {nsdecls("w")}><w:r><w:br w:type="page"/></w:r></w:p>')
+
+# Names of the markers of the loops between the designators, e.g. [#each] and [/each].
+LOOP_START = "#each"
+LOOP_END = "/each"
+
+
+class IndexedParagraph:
+    def __init__(self, element, part, runs: list, texts: list = None) -> None:
+        """Class for the run-offset index of a paragraph.
+
+        Holds the concatenated text of the RUNS and the offset of each run in it,
+        so a position in the paragraph text can be mapped back to the runs.
+
+        Args:
+            element: The w:p element of the paragraph.
+            part: The part of the package containing the paragraph.
+            runs (list): The w:r elements of the paragraph.
+            texts (list, optional): The already known texts of the runs. Defaults to None,
+                in which case the texts are read from the runs.
+        """
+        self.element = element
+        self.part = part
+        self.runs = runs
+        self.texts = [run.text for run in runs] if texts is None else list(texts)
+        self.update_offsets()
+
+    def update_offsets(self):
+        """Recalculates the paragraph text and the offsets of the runs from the run texts."""
+        self.starts = []
+        offset = 0
+        for text in self.texts:
+            self.starts.append(offset)
+            offset += len(text)
+        self.text = "".join(self.texts)
+
+    def replace(self, start: int, end: int, value: str, anchor: int = None):
+        """Replaces the text between START and END of the paragraph text with VALUE.
+
+        The VALUE is written into the run containing the ANCHOR position (defaults to START),
+        the rest of the replaced text is removed from the runs it spans.
+        The offsets are not updated, see update_offsets.
+
+        Returns the number of runs written."""
+        first = self._run_at(start)
+        last = self._run_at(end - 1)
+        target = self._run_at(start if anchor is None else anchor)
+        head = self.texts[first][: start - self.starts[first]]
+        tail = self.texts[last][end - self.starts[last] :]
+        for i in range(first, last + 1):
+            text = head if i == first else ""
+            if i == target:
+                text += value
+            if i == last:
+                text += tail
+            self._set_text(i, text)
+        return last - first + 1
+
+    def _run_at(self, position: int) -> int:
+        """Returns the index of the run containing POSITION of the paragraph text."""
+        return bisect.bisect_right(self.starts, position) - 1
+
+    def _set_text(self, i: int, text: str):
+        self.texts[i] = text
+        set_run_text(self.runs[i], text)
+
+
+def run_text(run: etree._Element) -> str:
+    """Returns the text of the w:r element RUN, the same way python-docx reads it."""
+    return "".join(str(e) for e in XPATH_RUN_CONTENT(run))
+
+
+def set_run_text(run, text: str):
+    """Sets the text of the w:r element RUN, producing the same XML as python-docx.
+
+    Text without tabs and line breaks is written as a single w:t directly,
+    instead of going through python-docx character by character."""
+    if "\t" in text or "\n" in text or "\r" in text:
+        run.text = text
+        return
+    for child in list(run):
+        if isinstance(child.tag, str) and child.tag != qn("w:rPr"):
+            run.remove(child)
+    if text:
+        t = OxmlElement("w:t")
+        t.text = text
+        if len(text.strip()) < len(text):
+            t.set(qn("xml:space"), "preserve")
+        run.append(t)
+
+
+def substitute_paragraphs(paragraphs: list, pattern: re.Pattern, values: dict) -> tuple:
+    """Substitutes the matches of PATTERN in the indexed PARAGRAPHS with the VALUES.
+
+    Looks up every template occurrence in the indexed paragraph texts, and replaces it
+    in the runs it spans, regardless of how many runs the template is split across.
+
+    Returns the number of substitutions made and the number of runs written."""
+    substitutions = runs = 0
+    for paragraph in paragraphs:
+        matches = list(pattern.finditer(paragraph.text))
+        # Replace from the end, so the offsets of the earlier matches stay valid.
+        for match in reversed(matches):
+            runs += paragraph.replace(
+                match.start(), match.end(), values[match.group("key")], match.start("key")
+            )
+        if matches:
+            paragraph.update_offsets()
+            substitutions += len(matches)
+    return substitutions, runs
+
+
+def count_matches(paragraphs: list, pattern: re.Pattern) -> int:
+    """Returns the number of matches of PATTERN in the texts of the indexed PARAGRAPHS."""
+    return sum(len(pattern.findall(paragraph.text)) for paragraph in paragraphs)
+
+
+def next_drawing_id(element) -> int:
+    """Returns the id following the largest id of the drawings in ELEMENT."""
+    ids = [drawing.get("id", "") for drawing in XPATH_DRAWING_IDS(element)]
+    return max((int(i) for i in ids if i.isdigit()), default=0) + 1
+
+
+def renumber_drawings(blocks: list, drawing_id: int) -> int:
+    """Gives the drawings of the copied BLOCKS their own ids, starting from DRAWING_ID.
+
+    Returns the next free id."""
+    for block in blocks:
+        for drawing in XPATH_DRAWING_IDS(block):
+            drawing.set("id", str(drawing_id))
+            drawing_id += 1
+    return drawing_id
+
+
+def block_paragraphs(block) -> list:
+    """Returns the w:p elements holding the text of the body, header or footer level BLOCK:
+    the paragraph and the paragraphs of its text boxes, or every paragraph of the table,
+    including the ones of nested tables, content controls and text boxes."""
+    if block.tag == qn("w:tbl"):
+        return XPATH_PARAGRAPHS(block)
+    return [block, *XPATH_TEXTBOX_PARAGRAPHS(block)]
+
+
+def iter_block_paragraphs(blocks: list):
+    """Yields the w:p elements of the BLOCKS in document order."""
+    return itertools.chain.from_iterable(block.iter(qn("w:p")) for block in blocks)
+
+
+def find_loops(paragraphs: list, markers: tuple) -> list:
+    """Finds the loops among the indexed PARAGRAPHS, MARKERS being the compiled patterns
+    of the loop start and end markers.
+
+    A paragraph with a start marker followed by a sibling paragraph with an end marker is a block
+    loop, the elements between them are repeated, the marker paragraphs are removed.
+    Otherwise a start marker in a table cell makes a row loop, the row is repeated,
+    the marker is removed from the paragraph. Loops can not be nested.
+
+    Returns a list of (elements, markers) tuples, the elements to repeat
+    and the marker paragraphs to remove."""
+    start_marker, end_marker = markers
+    indexed = {paragraph.element: paragraph for paragraph in paragraphs}
+    loops = []
+    in_loop = set()
+    for paragraph in paragraphs:
+        match = start_marker.search(paragraph.text)
+        if match is None or paragraph.element in in_loop:
+            continue
+        elements = []
+        end = None
+        for sibling in paragraph.element.itersiblings():
+            if sibling in indexed and end_marker.search(indexed[sibling].text):
+                end = sibling
+                break
+            elements.append(sibling)
+        if end is not None:
+            removed = [paragraph.element, end]
+        else:
+            row = next(paragraph.element.iterancestors(qn("w:tr")), None)
+            if row is None:
+                continue
+            elements = [row]
+            removed = []
+            for match in reversed(list(start_marker.finditer(paragraph.text))):
+                paragraph.replace(match.start(), match.end(), "")
+            paragraph.update_offsets()
+        in_loop.update(removed)
+        in_loop.update(iter_block_paragraphs(elements))
+        loops.append((elements, removed))
+    return loops
+
+
+def expand_loops(
+    paragraphs: list, markers: tuple, records: list, values: dict, template_pattern
+) -> tuple:
+    """Repeats the loops of the indexed PARAGRAPHS (see find_loops) for every templates dict
+    of RECORDS, substituting every copy with VALUES updated with the templates of its record.
+
+    The copies are made on the XML tree, the templated paragraphs of a copy are indexed
+    by their position in the repeated elements, without reading the runs again.
+    TEMPLATE_PATTERN is called with the values to compile the pattern of the templates.
+
+    Returns the indexed paragraphs outside the loops, the indexed paragraphs of the copies,
+    the number of loops, copies and substitutions made, and the number of runs written."""
+    loops = find_loops(paragraphs, markers)
+    if not loops:
+        return paragraphs, [], 0, 0, 0, 0
+    indexed = {paragraph.element: paragraph for paragraph in paragraphs}
+    patterns = {}
+    records = [{key: str(value) for key, value in record.items()} for record in records]
+    looped = set()
+    index = []
+    copies = substitutions = runs = 0
+    for elements, removed in loops:
+        positions = [
+            (position, indexed[p])
+            for position, p in enumerate(iter_block_paragraphs(elements))
+            if p in indexed
+        ]
+        looped.update(paragraph for _, paragraph in positions)
+        looped.update(indexed[p] for p in removed)
+        if elements:
+            drawing_id = next_drawing_id(elements[0].getroottree().getroot())
+            anchor = elements[-1]
+            for record in records:
+                record_values = {**values, **record}
+                blocks = [copy.deepcopy(element) for element in elements]
+                found = list(iter_block_paragraphs(blocks))
+                copied = [
+                    IndexedParagraph(
+                        found[position], paragraph.part, XPATH_RUNS(found[position]), paragraph.texts
+                    )
+                    for position, paragraph in positions
+                ]
+                if record_values:
+                    keys = frozenset(record_values)
+                    if keys not in patterns:
+                        patterns[keys] = template_pattern(record_values)
+                    made, written = substitute_paragraphs(copied, patterns[keys], record_values)
+                    substitutions += made
+                    runs += written
+                drawing_id = renumber_drawings(blocks, drawing_id)
+                for block in blocks:
+                    anchor.addnext(block)
+                    anchor = block
+                index += copied
+                copies += 1
+        for element in elements + removed:
+            element.getparent().remove(element)
+    outside = [paragraph for paragraph in paragraphs if paragraph not in looped]
+    return outside, index, len(loops), copies, substitutions, runs
 
 
 class Templating:
     def __init__(
         self,
-        input_file: str = None,
+        input_file: str | bytes = None,
         output_dir: str = None,
         template_start: str = "\[",
         template_end: str = "]",
         templates: dict = {},
+        engine: str = "docx",
+        stats: Stats = None,
+        records: list = None,
     ) -> None:
         """Class for templating .docx files, creates a .docx document based on the input_file
         substituting in the data based on the templates.
 
+        A table row with a [#each] marker (with the designators of the template), or the elements
+        between a [#each] and an [/each] marker paragraph, are repeated for every templates dict
+        of the records, see expand_loops.
+
         Args:
-            input_file (str, optional): Path to the input file. Defaults to None.
+            input_file (str | bytes, optional): Path to the input file, its content, or a binary
+                file-like object to read it from. Defaults to None.
             output_dir (str, optional): Path to the output folder. Defaults to None.
             template_start (str, optional): Regex pattern for the template start designator. Defaults to "\[".
             template_end (str, optional): Regex pattern for the template end designator. Defaults to "]".
             templates (dict, optional): Dict for the templates to substitute. Defaults to {}.
+            engine (str, optional): How the paragraphs are indexed, either through the python-docx
+                objects ("docx"), or directly on the XML elements ("lxml"). Defaults to "docx".
+            stats (Stats, optional): Records the duration of the parse, elements, index, substitute
+                and save phases, and the counts of the processed items. Defaults to None.
+            records (list, optional): The templates dicts the loops of the document are repeated
+                for. Defaults to None, in which case the loops are left as they are.
         """
-        self.document = docx.Document(input_file)
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}, expected one of {ENGINES}")
+        self.engine = engine
+        self.stats = NULL_STATS if stats is None else stats
+        if hasattr(input_file, "read"):
+            input_file = input_file.read()
+        self.input_file = input_file
+        with self.stats.phase("parse"):
+            self.document = docx.Document(self.open_input())
         self.output_dir = output_dir
         self.template_start = template_start
         self.template_end = template_end
         self.templates = templates.copy()
-        self.input_elements = self.get_input_elements()
+        self.records = records
+        with self.stats.phase("elements"):
+            self.input_elements = self.get_input_elements()
+        self.stats.count("elements", len(self.input_elements))
+        with self.stats.phase("index"):
+            self.paragraph_index = self.index_paragraphs()
+        self.partnames = {str(paragraph.part.partname) for paragraph in self.paragraph_index}
 
     def get_input_elements(self):
-        """Gets the sections and content elements of the .docx file.
+        """Gets the content elements of the body, and of every distinct header and footer
+        of the .docx file.
+
+        Headers and footers linked to the previous section are the ones already visited,
+        so every part is visited once. Sections without a header or footer are not given one.
 
         Elements are either docx.paragraph or docx.table"""
-        section_components = []
-        section_elements = []
+        elements = list(self.document.iter_inner_content())
+        parts = set()
         for section in self.document.sections:
-            section_components += [
+            for component in (
                 section.even_page_footer,
                 section.even_page_header,
                 section.first_page_footer,
                 section.first_page_header,
                 section.footer,
                 section.header,
-            ]
-            for component in section_components:
-                section_elements += component.paragraphs
-                section_elements += component.tables
+            ):
+                if component.is_linked_to_previous or component.part in parts:
+                    continue
+                parts.add(component.part)
+                elements += component.iter_inner_content()
+        return elements
 
-            section_elements += section.iter_inner_content()
-        return section_elements
+    def iter_paragraphs(self):
+        """Yields every paragraph of the input elements, including the paragraphs
+        of the (nested) table cells, of the content controls and of the text boxes."""
+        for element in self.input_elements:
+            for p in self._block_paragraphs(element):
+                yield element if p is element._element else docx.text.paragraph.Paragraph(p, element)
 
-    def sub(self, template: str, value: str):
-        """Substitutes TEMPLATE with VALUE in the document.
+    def _block_paragraphs(self, block) -> list:
+        """Returns the w:p elements of the paragraph or table BLOCK, see block_paragraphs.
+
+        Both engines select the paragraphs with it, so they produce the same documents."""
+        if isinstance(block, docx.table.Table) and self.stats.enabled:
+            self.stats.count("cells", len(XPATH_CELLS(block._tbl)))
+        return block_paragraphs(block._element)
+
+    def index_paragraphs(self) -> list:
+        """Indexes the paragraphs of the input elements that contain a template start designator.
+
+        Returns a list of IndexedParagraph, holding the text of the paragraph
+        and the offsets of its runs."""
+        start = re.compile(self.template_start)
+        paragraphs = self._index_docx() if self.engine == "docx" else self._index_lxml()
+        index = []
+        seen = set()
+        runs = 0
+        for paragraph in paragraphs:
+            # Paragraphs of nested text boxes are found through every enclosing paragraph.
+            if paragraph.element in seen:
+                continue
+            seen.add(paragraph.element)
+            runs += len(paragraph.runs)
+            if start.search(paragraph.text):
+                index.append(paragraph)
+        self.stats.count("paragraphs_scanned", len(seen))
+        self.stats.count("runs_scanned", runs)
+        self.stats.count("paragraphs_indexed", len(index))
+        return index
 
-        Iterates over the input elements checking if the element contains the TEMPLATE.
-        If so, it iterates over the runs in the elements and substitutes in the VALUE."""
-        reg = re.compile(self.template_start + template + self.template_end)
+    def _index_docx(self):
+        """Yields the IndexedParagraph of every paragraph, read through the python-docx objects."""
+        for paragraph in self.iter_paragraphs():
+            yield IndexedParagraph(paragraph._p, paragraph.part, paragraph._p.r_lst)
 
+    def _index_lxml(self):
+        """Yields the IndexedParagraph of every paragraph, read directly from the XML elements."""
         for element in self.input_elements:
-            try:
-                if reg.search(element.text):
-                    for i, run in enumerate(element.runs):
-                        if reg.search(run.text):
-                            run.text = reg.sub(value, run.text)
-                        elif re.search(self.template_start + template + "$", run.text):
-                            if re.search("^" + self.template_end, element.runs[i + 1].text):
-                                run.text = re.sub(
-                                    self.template_start + template + "$", value, run.text
-                                )
-                                element.runs[i + 1].text = re.sub(
-                                    "^" + self.template_end, "", element.runs[i + 1].text
-                                )
-                        elif re.search(self.template_start + "$", run.text):
-                            if re.search(
-                                "^" + template + self.template_end, element.runs[i + 1].text
-                            ):
-                                run.text = re.sub(self.template_start + "$", "", run.text)
-                                element.runs[i + 1].text = re.sub(
-                                    "^" + template + self.template_end,
-                                    value,
-                                    element.runs[i + 1].text,
-                                )
-                            elif element.runs[i + 1].text == template and re.search(
-                                "^" + self.template_end, element.runs[i + 2].text
-                            ):
-                                run.text = re.sub(self.template_start + "$", "", run.text)
-                                element.runs[i + 1].text = re.sub(
-                                    template, value, element.runs[i + 1].text
-                                )
-                                element.runs[i + 2].text = re.sub(
-                                    "^" + self.template_end, "", element.runs[i + 2].text
-                                )
-            # If the exception id raised the given element does not have a text attribute.
-            # That happes if the element is docx.table instead of docx.paragraph.
-            except AttributeError:
-                for row in element.rows:
-                    for cell in row.cells:
-                        for cell_p in cell.paragraphs:
-                            for i, cell_run in enumerate(cell_p.runs):
-                                if reg.search(cell_run.text):
-                                    cell_run.text = reg.sub(value, cell_run.text)
-                                elif re.search(self.template_start + template + "$", cell_run.text):
-                                    if re.search("^" + self.template_end, element.runs[i + 1].text):
-                                        cell_run.text = re.sub(
-                                            self.template_start + template + "$",
-                                            value,
-                                            cell_run.text,
-                                        )
-                                        element.runs[i + 1].text = re.sub(
-                                            "^" + self.template_end, "", element.runs[i + 1].text
-                                        )
-                                elif re.search(self.template_start + "$", cell_run.text):
-                                    if re.search(
-                                        "^" + template + self.template_end, element.runs[i + 1].text
-                                    ):
-                                        cell_run.text = re.sub(
-                                            self.template_start + "$", "", cell_run.text
-                                        )
-                                        element.runs[i + 1].text = re.sub(
-                                            "^" + template + self.template_end,
-                                            value,
-                                            element.runs[i + 1].text,
-                                        )
-                                    elif element.runs[i + 1].text == template and re.search(
-                                        "^" + self.template_end, element.runs[i + 2].text
-                                    ):
-                                        cell_run.text = re.sub(
-                                            self.template_start + "$", "", cell_run.text
-                                        )
-                                        element.runs[i + 1].text = re.sub(
-                                            template, value, element.runs[i + 1].text
-                                        )
-                                        element.runs[i + 2].text = re.sub(
-                                            "^" + self.template_end, "", element.runs[i + 2].text
-                                        )
+            for p in self._block_paragraphs(element):
+                runs = XPATH_RUNS(p)
+                yield IndexedParagraph(p, element.part, runs, [run_text(r) for r in runs])
+
+    def template_pattern(self, templates: dict) -> re.Pattern:
+        """Compiles the regex pattern matching any of the TEMPLATES between the designators.
+
+        The name of the template is captured in the "key" group."""
+        keys = "|".join(re.escape(key) for key in sorted(templates, key=len, reverse=True))
+        return re.compile(f"{self.template_start}(?P<key>{keys}){self.template_end}")
+
+    def loop_markers(self) -> tuple:
+        """Compiles the regex patterns of the loop start and end markers between the designators."""
+        return (
+            re.compile(f"{self.template_start}{re.escape(LOOP_START)}{self.template_end}"),
+            re.compile(f"{self.template_start}{re.escape(LOOP_END)}{self.template_end}"),
+        )
+
+    def placeholder_pattern(self) -> re.Pattern:
+        """Compiles the regex pattern matching any text between the designators,
+        used to count the templates left without a value."""
+        return re.compile(f"{self.template_start}(?P<key>.*?){self.template_end}")
+
+    def substitute(self, templates: dict, records: list = None):
+        """Substitutes all the TEMPLATES in the document in a single pass.
+
+        If RECORDS is given, the loops are repeated for each of its templates dicts first,
+        the copies substituted with the TEMPLATES updated with the record."""
+        values = {key: str(value) for key, value in templates.items()}
+        paragraphs = self.paragraph_index
+        if records is not None:
+            with self.stats.phase("loops"):
+                outside, copied, loops, copies, substitutions, runs = expand_loops(
+                    self.paragraph_index, self.loop_markers(), records, values, self.template_pattern
+                )
+            # The copies are already substituted.
+            paragraphs = outside
+            self.paragraph_index = outside + copied
+            self.stats.count("loops", loops)
+            self.stats.count("loop_copies", copies)
+            self.stats.count("substitutions", substitutions)
+            self.stats.count("runs_touched", runs)
+        if not templates:
+            return
+        with self.stats.phase("substitute"):
+            substitutions, runs = substitute_paragraphs(
+                paragraphs, self.template_pattern(values), values
+            )
+        self.stats.count("substitutions", substitutions)
+        self.stats.count("runs_touched", runs)
+        if self.stats.enabled:
+            unmatched = count_matches(self.paragraph_index, self.placeholder_pattern())
+            self.stats.count("placeholders_unmatched", unmatched)
+
+    def sub(self, template: str, value: str):
+        """Substitutes TEMPLATE with VALUE in the document."""
+        self.substitute({template: value})
 
     def sub_templates(self):
-        """Subtitutes all the templates in the documents."""
-        for template, value in self.templates.items():
-            self.sub(template=template, value=value)
+        """Subtitutes all the templates in the documents in a single pass,
+        repeating the loops for the records if given."""
+        self.substitute(self.templates, self.records)
+
+    def save(self, filename: str = "output.docx"):
+        """Save the document as FILENAME in the designated output folder.
 
-    def save(self):
-        """Save the document as 'output.docx' in the designated output folder.
+        Only the parts containing templates are serialized again,
+        the rest of the input file is copied as it is.
 
         Returns the path to the file."""
-        save_path = os.path.join("", self.output_dir, "output.docx")
-        self.document.save(save_path)
+        save_path = os.path.join("", self.output_dir, filename)
+        self.write(save_path)
         return save_path
+
+    def write(self, target):
+        """Writes the document to TARGET, a path or a writable binary file-like object.
+
+        Only the parts containing templates are serialized again,
+        the rest of the input file is copied as it is."""
+        partnames = self.templated_partnames()
+        with self.stats.phase("save"):
+            write_docx(self.document, self.open_input(), target, partnames)
+        self.stats.count("parts_written", len(partnames))
+
+    def to_bytes(self) -> bytes:
+        """Returns the content of the document as a .docx file."""
+        buffer = io.BytesIO()
+        self.write(buffer)
+        return buffer.getvalue()
+
+    def open_input(self):
+        """Returns the input file as a path, or as a new file-like object if given as bytes."""
+        if isinstance(self.input_file, bytes):
+            return io.BytesIO(self.input_file)
+        return self.input_file
+
+    def templated_partnames(self) -> set:
+        """Returns the names of the parts containing the indexed paragraphs."""
+        return set(self.partnames)
+
+
+class CompiledTemplate:
+    def __init__(
+        self,
+        input_file: str | bytes = None,
+        template_start: str = "\[",
+        template_end: str = "]",
+        engine: str = "docx",
+        stats: Stats = None,
+    ) -> None:
+        """Class for a parsed and indexed .docx template, that can be rendered many times
+        with different templates, without reparsing the input_file.
+
+        Only the XML parts containing templates are cloned for a render,
+        every other part (styles, media, ...) is shared with the parsed template.
+
+        Args:
+            input_file (str | bytes, optional): Path to the input file, its content, or a binary
+                file-like object to read it from. Defaults to None.
+            template_start (str, optional): Regex pattern for the template start designator. Defaults to "\[".
+            template_end (str, optional): Regex pattern for the template end designator. Defaults to "]".
+            engine (str, optional): How the template is indexed, see Templating. Defaults to "docx".
+            stats (Stats, optional): Records the phases of parsing the template (see Templating),
+                and of every render: clone, loops, substitute and save. Defaults to None.
+        """
+        self.template = Templating(
+            input_file, None, template_start, template_end, engine=engine, stats=stats
+        )
+        self.stats = self.template.stats
+        self.locations = self._locate_paragraphs()
+        templated = {id(part) for part, _ in self.locations}
+        templated.add(id(self.template.document.part))
+        self.shared_parts = {
+            id(part): part
+            for part in self.template.document.part.package.iter_parts()
+            if id(part) not in templated
+        }
+        # The main document part is always cloned, so it is always written.
+        self.partnames = {str(part.partname) for part, _ in self.locations}
+        self.partnames.add(str(self.template.document.part.partname))
+        self.patterns = {}
+        self.placeholders = self.template.placeholder_pattern()
+        self.markers = self.template.loop_markers()
+
+    def _locate_paragraphs(self) -> list:
+        """Returns the indexed paragraphs grouped by the part containing them,
+        together with the position of the paragraph element in the part."""
+        locations = {}
+        for paragraph in self.template.paragraph_index:
+            part = paragraph.part
+            if part not in locations:
+                locations[part] = (
+                    {p: i for i, p in enumerate(part.element.iter(qn("w:p")))},
+                    [],
+                )
+            positions, paragraphs = locations[part]
+            paragraphs.append((positions[paragraph.element], paragraph))
+        return [(part, paragraphs) for part, (_, paragraphs) in locations.items()]
+
+    def _pattern(self, values: dict) -> re.Pattern:
+        """Returns the compiled pattern for the keys of VALUES, compiled once per set of keys."""
+        keys = frozenset(values)
+        if keys not in self.patterns:
+            self.patterns[keys] = self.template.template_pattern(values)
+        return self.patterns[keys]
+
+    def render(
+        self, templates: dict, stats: Stats = None, records: list = None
+    ) -> docx.document.Document:
+        """Returns a new document with the TEMPLATES substituted in.
+
+        If RECORDS is given, the loops are repeated for each of its templates dicts,
+        see Templating. The parsed template itself is left untouched, so it can be rendered again.
+        The render is recorded in STATS if given, in the stats of the template otherwise."""
+        stats = self.stats if stats is None else stats
+        values = {key: str(value) for key, value in templates.items()}
+        with stats.phase("clone"):
+            memo = self.shared_parts.copy()
+            document = copy.deepcopy(self.template.document, memo)
+            index = []
+            for part, paragraphs in self.locations:
+                clone = memo[id(part)]
+                elements = list(clone.element.iter(qn("w:p")))
+                index += [
+                    IndexedParagraph(
+                        elements[position], clone, XPATH_RUNS(elements[position]), paragraph.texts
+                    )
+                    for position, paragraph in paragraphs
+                ]
+        outside = index
+        if records is not None:
+            with stats.phase("loops"):
+                outside, copied, loops, copies, substitutions, runs = expand_loops(
+                    index, self.markers, records, values, self._pattern
+                )
+            index = outside + copied
+            stats.count("loops", loops)
+            stats.count("loop_copies", copies)
+            stats.count("substitutions", substitutions)
+            stats.count("runs_touched", runs)
+        substitutions = runs = 0
+        with stats.phase("substitute"):
+            if values:
+                substitutions, runs = substitute_paragraphs(outside, self._pattern(values), values)
+        stats.count("renders")
+        stats.count("substitutions", substitutions)
+        stats.count("runs_touched", runs)
+        if stats.enabled:
+            stats.count("placeholders_unmatched", count_matches(index, self.placeholders))
+        return document
+
+    def render_combined(
+        self, records: list, separator: str = "page", stats: Stats = None
+    ) -> docx.document.Document:
+        """Returns a new document with the body of the template repeated for every templates dict
+        of RECORDS, each copy substituted with its own templates.
+
+        The copies are separated by a page break, or with SEPARATOR "section" by a section break
+        having the properties of the last section of the template. The headers, footers, styles
+        and media are shared by the records, the headers and footers are filled in with the
+        templates of the first record. The render is recorded in STATS if given,
+        in the stats of the template otherwise."""
+        if separator not in SEPARATORS:
+            raise ValueError(f"Unknown separator: {separator}, expected one of {SEPARATORS}")
+        records = list(records)
+        if not records:
+            raise ValueError("No records to render")
+        stats = self.stats if stats is None else stats
+        document = self.render(records[0], stats)
+        main_part = self.template.document.part
+        paragraphs = next((found for part, found in self.locations if part is main_part), [])
+        template_body = main_part.element.body
+        blocks = [child for child in template_body if child.tag != qn("w:sectPr")]
+        body = document.element.body
+        sect_pr = body.get_or_add_sectPr()
+        drawing_id = next_drawing_id(body)
+
+        for templates in records[1:]:
+            values = {key: str(value) for key, value in templates.items()}
+            with stats.phase("clone"):
+                copies = [copy.deepcopy(block) for block in blocks]
+                # The paragraphs of the copied blocks are in the same order as in the template body.
+                elements = list(iter_block_paragraphs(copies))
+                index = [
+                    IndexedParagraph(
+                        elements[position],
+                        document.part,
+                        XPATH_RUNS(elements[position]),
+                        paragraph.texts,
+                    )
+                    for position, paragraph in paragraphs
+                ]
+                # Every drawing of the document needs its own id.
+                drawing_id = renumber_drawings(copies, drawing_id)
+            substitutions = runs = 0
+            with stats.phase("substitute"):
+                if values:
+                    substitutions, runs = substitute_paragraphs(index, self._pattern(values), values)
+            stats.count("renders")
+            stats.count("substitutions", substitutions)
+            stats.count("runs_touched", runs)
+            if stats.enabled:
+                stats.count("placeholders_unmatched", count_matches(index, self.placeholders))
+
+            if separator == "page":
+                copies.insert(0, copy.deepcopy(PAGE_BREAK))
+            else:
+                # The section of the previous record ends with this paragraph.
+                paragraph = body._new_p()
+                paragraph.get_or_add_pPr().append(copy.deepcopy(sect_pr))
+                copies.insert(0, paragraph)
+            for block in copies:
+                sect_pr.addprevious(block)
+        return document
+
+    def save(self, document: docx.document.Document, target, stats: Stats = None):
+        """Writes the rendered DOCUMENT to TARGET, a path or a writable binary file-like object.
+
+        Only the parts containing templates are serialized again,
+        the rest of the input file is copied as it is."""
+        stats = self.stats if stats is None else stats
+        with stats.phase("save"):
+            write_docx(document, self.template.open_input(), target, self.partnames)
+        stats.count("parts_written", len(self.partnames))
+
+    def render_bytes(self, templates: dict, stats: Stats = None, records: list = None) -> bytes:
+        """Returns the content of a new document with the TEMPLATES substituted in, as a .docx file."""
+        buffer = io.BytesIO()
+        self.save(self.render(templates, stats, records), buffer, stats)
+        return buffer.getvalue()
+
+    def render_combined_bytes(
+        self, records: list, separator: str = "page", stats: Stats = None
+    ) -> bytes:
+        """Returns the content of a new document with the body of the template repeated for every
+        record, as a .docx file, see render_combined."""
+        buffer = io.BytesIO()
+        self.save(self.render_combined(records, separator, stats), buffer, stats)
+        return buffer.getvalue()
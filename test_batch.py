@@ -0,0 +1,185 @@
+import concurrent.futures
+import os
+
+import pytest
+
+import batch
+import cli
+from batch import CHUNKS_PER_WORKER, Manifest, render_batch, select_records
+from conftest import END, START, table_rows
+from data import TwoLevelDataset
+
+
+CSV = """Company,Contact,Email
+Acme,John,john@acme.test
+Acme,Jane,jane@acme.test
+Bolt,Anna,anna@bolt.test
+"""
+
+ACME_ROWS = [["Name", "Email"], ["John", "john@acme.test"], ["Jane", "jane@acme.test"]]
+
+
+@pytest.fixture
+def data_source(tmp_path) -> str:
+    path = tmp_path / "data.csv"
+    path.write_text(CSV, encoding="utf-8")
+    return str(path)
+
+
+def test_loops_list_every_record_of_the_company(tmp_path, loop_template, data_source):
+    dataset = TwoLevelDataset(data_source)
+    os.makedirs(tmp_path / "out")
+    # Only one of the records is rendered, e.g. the one left of an interrupted run.
+    results = render_batch(
+        loop_template,
+        dataset,
+        str(tmp_path / "out"),
+        START,
+        END,
+        records=[("Acme", "Jane")],
+        workers=1,
+        loops=True,
+    )
+    assert [result.ok for result in results] == [True]
+    assert table_rows(results[0].path) == ACME_ROWS
+
+
+def test_resumed_run_renders_the_same_loops(tmp_path, loop_template, data_source):
+    output_dir = tmp_path / "out"
+    argv = [loop_template, str(output_dir), "--data", data_source, "--loops", "--workers", "1"]
+    assert cli.main(argv) == 0
+    path = output_dir / "Acme - John.docx"
+    first = table_rows(str(path))
+    os.remove(path)
+
+    assert cli.main(argv) == 0
+    assert table_rows(str(path)) == first == ACME_ROWS
+
+
+def test_contact_selection_does_not_narrow_the_loops(tmp_path, loop_template, data_source):
+    output_dir = tmp_path / "out"
+    argv = [loop_template, str(output_dir), "--data", data_source, "--loops", "--workers", "1"]
+    assert cli.main(argv + ["--contact", "Jane"]) == 0
+    assert sorted(os.listdir(output_dir)) == ["Acme - Jane.docx", "manifest.jsonl"]
+    assert table_rows(str(output_dir / "Acme - Jane.docx")) == ACME_ROWS
+
+
+def test_manifest_refuses_other_settings(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    Manifest(path, {"template_sha256": "abc", "loops": False})
+    # The same settings resume the run.
+    Manifest(path, {"template_sha256": "abc", "loops": False})
+    with pytest.raises(ValueError, match="loops"):
+        Manifest(path, {"template_sha256": "abc", "loops": True})
+
+
+def test_rerun_with_other_options_needs_restart(tmp_path, loop_template, data_source):
+    output_dir = tmp_path / "out"
+    argv = [loop_template, str(output_dir), "--data", data_source, "--workers", "1"]
+    assert cli.main(argv) == 0
+    path = str(output_dir / "Acme - John.docx")
+    first = table_rows(path)
+    assert cli.main(argv + ["--loops"]) == 2
+    assert table_rows(path) == first
+
+    assert cli.main(argv + ["--loops", "--restart"]) == 0
+    assert table_rows(path) == ACME_ROWS
+
+
+def test_companies_and_contacts_are_matched_case_insensitively(tmp_path, loop_template, data_source):
+    output_dir = tmp_path / "out"
+    argv = [loop_template, str(output_dir), "--data", data_source, "--workers", "1"]
+    assert cli.main(argv + ["--company", "acme", "--contact", "JANE"]) == 0
+    assert sorted(os.listdir(output_dir)) == ["Acme - Jane.docx", "manifest.jsonl"]
+
+
+@pytest.mark.parametrize(
+    "options, message",
+    [
+        (["--company", "Cargo"], "Unknown companies: Cargo"),
+        (["--company", "Bolt", "--contact", "John"], "Unknown contacts: John"),
+        (["--pattern", "{Company} - {Phone}.docx"], "Unknown field 'Phone'"),
+        (["--pattern", "{Company"], "Invalid file name pattern"),
+        (["--data", "missing.csv"], "Dataset not found"),
+    ],
+)
+def test_invalid_options_are_reported(tmp_path, loop_template, data_source, capsys, options, message):
+    argv = [loop_template, str(tmp_path / "out"), "--data", data_source, "--workers", "1"]
+    assert cli.main(argv + options) == 2
+    assert message in capsys.readouterr().err
+
+
+def test_missing_template_is_reported(tmp_path, data_source, capsys):
+    argv = [str(tmp_path / "missing.docx"), str(tmp_path / "out"), "--data", data_source]
+    assert cli.main(argv) == 2
+    assert "Template not found" in capsys.readouterr().err
+
+
+def test_memory_limit_is_refused_without_resource(
+    tmp_path, loop_template, data_source, monkeypatch, capsys
+):
+    # E.g. on Windows, the workers could not limit their memory.
+    monkeypatch.setattr(batch, "resource", None)
+    argv = [loop_template, str(tmp_path / "out"), "--data", data_source, "--max-memory", "512"]
+    assert cli.main(argv) == 2
+    assert "not supported" in capsys.readouterr().err
+
+
+def test_rerun_with_edited_data_needs_restart(tmp_path, loop_template, data_source):
+    output_dir = tmp_path / "out"
+    argv = [loop_template, str(output_dir), "--data", data_source, "--workers", "1"]
+    assert cli.main(argv) == 0
+    with open(data_source, "a", encoding="utf-8") as file:
+        file.write("Bolt,Bob,bob@bolt.test\n")
+    # The records already rendered may have changed too.
+    assert cli.main(argv) == 2
+    assert cli.main(argv + ["--restart"]) == 0
+    assert "Bolt - Bob.docx" in os.listdir(output_dir)
+
+
+class RecordingExecutor(concurrent.futures.ProcessPoolExecutor):
+    """ProcessPoolExecutor recording the most chunks submitted and not yet finished."""
+
+    in_flight = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.futures = []
+
+    def submit(self, *args, **kwargs):
+        future = super().submit(*args, **kwargs)
+        self.futures.append(future)
+        # Counted from the futures not done yet, so it is never more than in flight.
+        running = sum(not future.done() for future in self.futures)
+        RecordingExecutor.in_flight = max(RecordingExecutor.in_flight, running)
+        return future
+
+
+def test_pool_renders_every_record_in_order(tmp_path, make_template, monkeypatch):
+    rows = [f"Company{i % 5},Contact{i},contact{i}@test" for i in range(40)]
+    path = tmp_path / "data.csv"
+    path.write_text("Company,Contact,Email\n" + "\n".join(rows) + "\n", encoding="utf-8")
+    dataset = TwoLevelDataset(str(path))
+    records = select_records(dataset)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", RecordingExecutor)
+    finished = []
+    output_dir = tmp_path / "out"
+    os.makedirs(output_dir)
+
+    results = render_batch(
+        make_template(paragraphs=3),
+        dataset,
+        str(output_dir),
+        START,
+        END,
+        records=records,
+        workers=2,
+        on_result=finished.append,
+    )
+    # The results are in the order of the records, whichever chunk finished first.
+    assert [(result.company, result.contact) for result in results] == records
+    assert all(result.ok for result in results)
+    assert sorted(result.path for result in finished) == sorted(result.path for result in results)
+    assert len(os.listdir(output_dir)) == 40
+    # 40 records on 2 workers are 8 chunks, only a few of them are queued at a time.
+    assert 0 < RecordingExecutor.in_flight <= 2 * CHUNKS_PER_WORKER
@@ -0,0 +1,13 @@
+import pytest
+
+import benchmark
+
+
+@pytest.mark.skipif(benchmark.resource is None, reason="needs the resource module")
+def test_measure_reports_the_peak_rss_of_the_phase():
+    size = 64 * 1024 * 1024
+    measured = benchmark.measure(lambda data: len(data * 2), 1, lambda: b"x" * size)
+    # The setup is not counted, the copy made by the phase is.
+    assert measured["peak_rss_increase_bytes"] >= size // 2
+    assert measured["peak_rss_bytes"] >= size * 2
+    assert measured["peak_python_bytes"] >= size * 2
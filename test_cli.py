@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+HEAVY_MODULES = ["docx", "lxml", "pandas", "numpy"]
+
+
+@pytest.mark.parametrize("module", ["cli", "interface", "main"])
+def test_startup_does_not_import_heavy_modules(module):
+    # Run in a fresh interpreter, the modules are already imported by the other tests.
+    code = f"import sys, {module}; print(' '.join(sorted(set({HEAVY_MODULES!r}) & set(sys.modules))))"
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert output.strip() == ""
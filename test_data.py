@@ -0,0 +1,174 @@
+import pandas as pd
+import pytest
+
+from data import BACKENDS, TwoLevelDataset
+from stats import Stats
+
+
+MIXED_CSV = """Company,Contact,Count,Rating,Flag,Zip
+Acme,John,1,1.0,True,1234
+Acme,Jane,0,0.0,False,
+Bolt,Anna,2,2.5,True,5678
+Acme,John,3,3.0,False,9999
+"""
+
+
+def write_csv(tmp_path, text: str, name: str = "data.csv") -> str:
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def plain(value):
+    """Returns VALUE as a python value, numpy scalars converted."""
+    return value.item() if hasattr(value, "item") else value
+
+
+def baseline_data(data_source: str, separator: str = ",") -> dict:
+    """Returns the dataset built the way TwoLevelDataset originally built it, row by row from pandas."""
+    header = pd.read_csv(data_source, index_col=None, header=None, nrows=1, sep=separator).iloc[0].to_list()
+    df = (
+        pd.read_csv(data_source, index_col=None, header=0, sep=separator)
+        .sort_values(by=[header[0]], ascending=True, kind="stable")
+        .fillna("")
+    )
+    data = {}
+    for r in range(len(df)):
+        row = df.iloc[r]
+        primary = str(row.iloc[0]).title()
+        secondary = str(row.iloc[1]).title()
+        contacts = data.setdefault(primary, {})
+        if secondary not in contacts:
+            contacts[secondary] = {
+                str(col).title(): plain(row.iloc[i + 2]) for i, col in enumerate(header[2:])
+            }
+    return data
+
+
+def nested(dataset: TwoLevelDataset) -> dict:
+    return {
+        primary: {secondary: dict(record) for secondary, record in contacts.items()}
+        for primary, contacts in dataset.get_data().items()
+    }
+
+
+def typed(data: dict) -> dict:
+    """Returns DATA with every value paired with its type, as 1 == 1.0 == True."""
+    return {
+        primary: {
+            secondary: {name: (type(value), value) for name, value in record.items()}
+            for secondary, record in contacts.items()
+        }
+        for primary, contacts in data.items()
+    }
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_mixed_types_match_baseline(tmp_path, backend):
+    path = write_csv(tmp_path, MIXED_CSV)
+    data = nested(TwoLevelDataset(path, backend=backend))
+    assert typed(data) == typed(baseline_data(path))
+    assert data["Acme"]["John"] == {"Count": 1, "Rating": 1.0, "Flag": True, "Zip": 1234.0}
+    assert type(data["Acme"]["John"]["Rating"]) is float
+    assert type(data["Acme"]["Jane"]["Flag"]) is bool
+
+
+# The types of the columns change with values only in the later rows: an empty zip code,
+# a float rating, a text flag, and numeric company keys that are read as floats if one is missing.
+LATE_TYPES_CSV = """Company,Contact,Zip,Rating,Flag
+2,Anna,1234,1,True
+1,John,5678,2,False
+1,Jane,9012,3,True
+3,Bob,,4.5,maybe
+,Nobody,3456,5,False
+1,John,7890,6,True
+"""
+
+
+@pytest.mark.parametrize("text", [MIXED_CSV, LATE_TYPES_CSV], ids=["mixed", "late_types"])
+@pytest.mark.parametrize("chunksize", [1, 2, 3, 100])
+def test_chunked_load_matches_full_load(tmp_path, text, chunksize):
+    path = write_csv(tmp_path, text)
+    full = TwoLevelDataset(path)
+    chunked = TwoLevelDataset(path, chunksize=chunksize)
+    assert chunked.get_primary_list() == full.get_primary_list()
+    assert typed(nested(chunked)) == typed(nested(full))
+    assert typed(nested(full)) == typed(baseline_data(path))
+
+
+# Quoting, separators and newlines in quoted values, whitespace, the NA tokens of pandas,
+# an empty and a repeated column name, repeated contacts and a missing company.
+EDGE_CASES_CSV = '''Company,Contact,,Email,Email,Count,Score,Active,Note
+"Bolt, Inc",Anna,x,anna@bolt.test,a2,3,1.5,true,"multi
+line"
+acme,john,y,john@acme.test,j2,1,2,FALSE,NA
+Acme,JOHN,z,duplicate@acme.test,j3,,-0.5,True,n/a
+,Nobody,w,nobody@test,n2,4,inf,false, padded 
+Cargo,Eve,v,eve@cargo.test,e2,5,1e3,True,"say ""hi"""
+Acme,Jane,u,jane@acme.test,j4,6,,,None
+'''
+
+
+@pytest.mark.parametrize("separator", [",", ";"])
+def test_csv_backend_matches_pandas(tmp_path, separator):
+    text = EDGE_CASES_CSV if separator == "," else EDGE_CASES_CSV.replace(",", ";")
+    path = write_csv(tmp_path, text)
+    pandas_dataset = TwoLevelDataset(path, separator, backend="pandas")
+    csv_dataset = TwoLevelDataset(path, separator, backend="csv")
+    assert csv_dataset.get_primary_list() == pandas_dataset.get_primary_list()
+    for primary in pandas_dataset.get_primary_list():
+        assert csv_dataset.get_secondary_list(primary) == pandas_dataset.get_secondary_list(primary)
+    assert typed(nested(csv_dataset)) == typed(nested(pandas_dataset))
+
+
+@pytest.mark.parametrize("backend, chunksize", [("pandas", None), ("pandas", 2), ("csv", None)])
+def test_header_names_are_read_as_written(tmp_path, backend, chunksize):
+    path = write_csv(tmp_path, EDGE_CASES_CSV)
+    record = TwoLevelDataset(path, backend=backend, chunksize=chunksize).get_data()["Cargo"]["Eve"]
+    # An empty name is kept, a repeated name holds the value of its last column.
+    assert list(record) == ["", "Email", "Count", "Score", "Active", "Note"]
+    assert record[""] == "v" and record["Email"] == "e2"
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_cache_is_loaded_while_the_csv_is_unchanged(tmp_path, backend):
+    path = write_csv(tmp_path, EDGE_CASES_CSV)
+    built = TwoLevelDataset(path, cache=True, backend=backend)
+    stats = Stats()
+    cached = TwoLevelDataset(path, cache=True, backend=backend, stats=stats)
+    assert stats.counters["cache_hits"] == 1
+    assert cached.get_primary_list() == built.get_primary_list()
+    assert typed(nested(cached)) == typed(nested(built))
+
+
+def test_cache_is_rebuilt_when_the_csv_changes(tmp_path):
+    path = write_csv(tmp_path, MIXED_CSV)
+    TwoLevelDataset(path, cache=True)
+    path = write_csv(tmp_path, MIXED_CSV + "Cargo,Eve,4,4.0,True,1111\n")
+    stats = Stats()
+    dataset = TwoLevelDataset(path, cache=True, stats=stats)
+    assert "cache_hits" not in stats.counters
+    assert "Cargo" in dataset.get_primary_list()
+    # The cache of another backend is not shared.
+    stats = Stats()
+    TwoLevelDataset(path, cache=True, backend="csv", stats=stats)
+    assert "cache_hits" not in stats.counters
+
+
+@pytest.mark.parametrize(
+    "content",
+    [b"", b"not json\n", b"\x80\x04\x95 pickled\n", None],
+    ids=["empty", "text", "binary", "truncated"],
+)
+def test_corrupt_cache_is_rebuilt(tmp_path, content):
+    path = write_csv(tmp_path, MIXED_CSV)
+    TwoLevelDataset(path, cache=True)
+    with open(path + ".cache", "rb") as file:
+        lines = file.readlines()
+    with open(path + ".cache", "wb") as file:
+        # Truncated: the key of the current CSV, the dataset cut short.
+        file.write(lines[0] + lines[1][:20] if content is None else content)
+    stats = Stats()
+    dataset = TwoLevelDataset(path, cache=True, stats=stats)
+    assert "cache_hits" not in stats.counters
+    assert typed(nested(dataset)) == typed(baseline_data(path))
@@ -0,0 +1,83 @@
+import io
+import struct
+import zipfile
+
+import docx
+import pytest
+
+from conftest import END, START
+from templating import Templating
+
+
+MEDIA = "word/media/image1.png"
+
+
+class NonSeekable:
+    """Write-only binary stream, like a pipe or a socket."""
+
+    def __init__(self) -> None:
+        self.buffer = io.BytesIO()
+
+    def write(self, data: bytes) -> int:
+        return self.buffer.write(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self) -> bytes:
+        return self.buffer.getvalue()
+
+
+def with_data_descriptors(content: bytes) -> bytes:
+    """Returns the zip CONTENT written again to a non-seekable stream, so that every member
+    has its sizes and CRC in a data descriptor after its data (flag bit 3)."""
+    stream = NonSeekable()
+    with zipfile.ZipFile(io.BytesIO(content)) as source:
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as target:
+            for info in source.infolist():
+                with target.open(info.filename, "w") as member:
+                    member.write(source.read(info))
+    return stream.getvalue()
+
+
+def raw_data(content: bytes, name: str) -> bytes:
+    """Returns the compressed data of the member NAME of the zip CONTENT, as stored."""
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        info = archive.getinfo(name)
+    name_length, extra_length = struct.unpack_from("<HH", content, info.header_offset + 26)
+    start = info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+    return content[start : start + info.compress_size]
+
+
+@pytest.fixture
+def source(make_template) -> bytes:
+    with open(make_template(paragraphs=3, split=2, media=True), "rb") as file:
+        content = with_data_descriptors(file.read())
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        assert all(info.flag_bits & 0x08 for info in archive.infolist())
+    return content
+
+
+@pytest.mark.parametrize("seekable", [True, False], ids=["seekable", "non_seekable"])
+def test_copied_members_round_trip(source, seekable):
+    template = Templating(source, None, START, END, {"email": "jane@acme.test"})
+    template.sub_templates()
+    target = io.BytesIO() if seekable else NonSeekable()
+    template.write(target)
+    content = target.getvalue()
+
+    rewritten = {name.lstrip("/") for name in template.templated_partnames()}
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        assert archive.testzip() is None
+        with zipfile.ZipFile(io.BytesIO(source)) as original:
+            assert archive.namelist() == original.namelist()
+            for info in archive.infolist():
+                if info.filename not in rewritten:
+                    assert archive.read(info) == original.read(info.filename)
+    # The untouched media is copied as it was compressed, without the data descriptor.
+    assert raw_data(content, MEDIA) == raw_data(source, MEDIA)
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        assert not archive.getinfo(MEDIA).flag_bits & 0x08
+
+    document = docx.Document(io.BytesIO(content))
+    assert "jane@acme.test" in "\n".join(paragraph.text for paragraph in document.paragraphs)
@@ -0,0 +1,54 @@
+import os
+import threading
+
+import docx
+
+from conftest import END, START, VALUES
+from render_queue import CancelledError, RenderQueue
+
+
+def collect(render_queue: RenderQueue, count: int) -> list:
+    """Returns the next COUNT results of RENDER_QUEUE."""
+    return [render_queue.results.get(timeout=30) for _ in range(count)]
+
+
+def test_jobs_are_rendered_in_order(tmp_path, make_template):
+    template = make_template(paragraphs=2)
+    render_queue = RenderQueue(START, END)
+    paths = [str(tmp_path / f"out{i}.docx") for i in range(4)]
+    ids = [
+        render_queue.submit(template, path, {**VALUES, "email": f"email {i}"})
+        for i, path in enumerate(paths)
+    ]
+    results = collect(render_queue, len(paths))
+    assert results == [(job_id, path, None) for job_id, path in zip(ids, paths)]
+    for i, path in enumerate(paths):
+        text = "\n".join(paragraph.text for paragraph in docx.Document(path).paragraphs)
+        assert f"email {i}" in text
+
+
+def test_cancel_skips_the_submitted_jobs(tmp_path, make_template):
+    template = make_template(paragraphs=2)
+    render_queue = RenderQueue(START, END)
+    # The first job is held in the render, so the others are still queued when cancelled.
+    release = threading.Event()
+    compile_template = render_queue._compile_template
+
+    def held(input_file):
+        release.wait(30)
+        return compile_template(input_file)
+
+    render_queue._compile_template = held
+    paths = [str(tmp_path / f"out{i}.docx") for i in range(4)]
+    for path in paths[:3]:
+        render_queue.submit(template, path, VALUES)
+    render_queue.cancel()
+    render_queue.submit(template, paths[3], VALUES)
+    release.set()
+
+    results = collect(render_queue, len(paths))
+    assert [job_id for job_id, _, _ in results] == [1, 2, 3, 4]
+    # The running render is not saved either.
+    assert all(isinstance(error, CancelledError) for _, _, error in results[:3])
+    assert not any(os.path.exists(path) for path in paths[:3])
+    assert results[3][2] is None and os.path.exists(paths[3])
@@ -0,0 +1,50 @@
+import pytest
+
+from search import SubstringIndex
+
+
+NAMES = ["Acme", "Bolt, Inc", "acme labs", "Cargo", "Macmeister", "Ölwerk", "Bolton", "ACM", "a"]
+
+
+def brute_force(names: list, query: str) -> list:
+    return [name for name in names if query.lower() in name.lower()]
+
+
+@pytest.mark.parametrize(
+    "queries",
+    [
+        ["acm", "acme", "acme ", "acme l"],
+        ["a", "ac", "acm", "ac", "a", ""],
+        ["BOLT", "olt", "bolton", "xyz", "bolt"],
+        ["ö", "öl", "ÖLW", "werk"],
+        ["me", "cme", "acme"],
+    ],
+    ids=["extended", "shortened", "case", "unicode", "prefixed"],
+)
+def test_search_matches_brute_force(queries):
+    index = SubstringIndex(NAMES)
+    for query in queries:
+        # The results keep the order of the names.
+        assert index.search(query) == brute_force(NAMES, query), query
+
+
+def test_extended_query_only_checks_previous_results(monkeypatch):
+    index = SubstringIndex(NAMES)
+    assert index.search("acm") == ["Acme", "acme labs", "Macmeister", "ACM"]
+
+    def candidates(query):
+        raise AssertionError("the index is looked up again")
+
+    monkeypatch.setattr(index, "_candidates", candidates)
+    assert index.search("acme") == ["Acme", "acme labs", "Macmeister"]
+    assert index.search("acme lab") == ["acme labs"]
+    assert index.search("acme labs!") == []
+
+
+def test_index_is_built_for_long_queries_only():
+    index = SubstringIndex(NAMES)
+    index.search("ac")
+    assert index.postings is None
+    index.search("olt")
+    assert index.postings is not None
+    assert list(index.postings["olt"]) == [1, 6]
@@ -0,0 +1,119 @@
+import base64
+import hashlib
+import http.client
+import io
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import docx
+import pytest
+
+from conftest import END, START
+from server import RenderRequestHandler, RenderService
+
+
+@pytest.fixture(scope="module")
+def template() -> bytes:
+    document = docx.Document()
+    document.add_paragraph("Dear [[contact]],")
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def server():
+    service = RenderService(workers=1, template_start=START, template_end=END)
+    RenderRequestHandler.service = service
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RenderRequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, service
+    httpd.shutdown()
+    httpd.server_close()
+    service.shutdown()
+
+
+def post(server, path: str, body) -> tuple:
+    """Returns the status and the body of the response to POSTing BODY (bytes, or JSON) to PATH."""
+    httpd, _ = server
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    connection = http.client.HTTPConnection(*httpd.server_address)
+    try:
+        connection.request("POST", path, body)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def test_render_inline_template(server, template):
+    request = {"template": base64.b64encode(template).decode(), "values": {"contact": "Jane"}}
+    status, content = post(server, "/render", request)
+    assert status == 200
+    assert docx.Document(io.BytesIO(content)).paragraphs[0].text == "Dear Jane,"
+    # The inline templates are passed to the workers, not stored in the spool.
+    _, service = server
+    assert not service.has_template(hashlib.sha256(template).hexdigest())
+
+
+@pytest.mark.parametrize(
+    "request_body",
+    [
+        {"template": "!!!"},
+        {"template": ""},
+        {"template": base64.b64encode(b"not a docx").decode()},
+        {"template": 1},
+        [],
+    ],
+)
+def test_invalid_template_is_a_client_error(server, request_body):
+    status, content = post(server, "/render", request_body)
+    assert status == 400, content
+
+
+def test_upload_of_not_a_docx_is_a_client_error(server):
+    status, _ = post(server, "/templates", b"not a docx")
+    assert status == 400
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [{"values": ["contact"]}, {"values": "Jane"}, {"records": {"contact": "Jane"}}, {"records": [1]}],
+)
+def test_invalid_values_are_a_client_error(server, template, fields):
+    _, body = post(server, "/templates", template)
+    request = {"template_id": json.loads(body)["template_id"], **fields}
+    status, content = post(server, "/render", request)
+    assert status == 400, content
+
+
+def test_shutdown_removes_the_temporary_spool(tmp_path):
+    service = RenderService(workers=1)
+    given = RenderService(workers=1, spool_dir=str(tmp_path))
+    service.shutdown()
+    given.shutdown()
+    assert not os.path.exists(service.spool_dir)
+    assert os.path.exists(given.spool_dir)
+
+
+def test_render_errors_are_server_errors(server, template, monkeypatch):
+    _, service = server
+
+    def render(template_id, templates, records=None, content=None):
+        # E.g. a bug in the worker, raising an error of the kind that invalid requests raise.
+        raise KeyError("paragraph")
+
+    monkeypatch.setattr(service, "render", render)
+    request = {"template": base64.b64encode(template).decode(), "values": {"contact": "Jane"}}
+    status, content = post(server, "/render", request)
+    assert status == 500
+    assert b"KeyError" in content
+
+
+def test_unknown_template_is_not_found(server):
+    status, _ = post(server, "/render", {"template_id": "0" * 64})
+    assert status == 404
@@ -0,0 +1,77 @@
+import json
+import logging
+
+import pytest
+
+from conftest import END, START, VALUES
+from stats import NULL_STATS, Stats
+from templating import Templating
+
+
+def test_phases_and_counters_add_up():
+    finished = []
+    stats = Stats(callback=lambda name, seconds: finished.append(name))
+    for _ in range(2):
+        with stats.phase("render"):
+            stats.count("paragraphs", 3)
+    with pytest.raises(RuntimeError):
+        with stats.phase("save"):
+            raise RuntimeError("failed")
+    stats.count("documents")
+
+    # A phase ending with an error is measured too.
+    assert finished == ["render", "render", "save"]
+    assert stats.calls == {"render": 2, "save": 1}
+    assert stats.seconds["render"] >= 0 and stats.seconds["save"] >= 0
+    assert stats.counters == {"paragraphs": 6, "documents": 1}
+
+
+def test_merge_sums_stats_and_their_dicts():
+    first = Stats()
+    with first.phase("render"):
+        first.count("paragraphs", 2)
+    second = Stats()
+    with second.phase("render"):
+        pass
+    with second.phase("save"):
+        second.count("paragraphs", 5)
+        second.count("parts_written")
+
+    totals = Stats()
+    totals.merge(first)
+    # The stats of the batch renders come back from the workers as dicts.
+    totals.merge(json.loads(json.dumps(second.to_dict())))
+    result = totals.to_dict()
+    assert result["counters"] == {"paragraphs": 7, "parts_written": 1}
+    assert {name: phase["calls"] for name, phase in result["phases"].items()} == {"render": 2, "save": 1}
+    assert result["phases"]["render"]["seconds"] == pytest.approx(
+        first.seconds["render"] + second.seconds["render"]
+    )
+
+
+def test_log_writes_a_json_line(caplog):
+    stats = Stats()
+    stats.count("records", 2)
+    with caplog.at_level(logging.INFO, logger="stats"):
+        stats.log(event="batch", template="letter.docx")
+    assert len(caplog.records) == 1
+    line = json.loads(caplog.records[0].getMessage())
+    assert line == {"event": "batch", "template": "letter.docx", "phases": {}, "counters": {"records": 2}}
+
+
+def test_null_stats_record_nothing():
+    with NULL_STATS.phase("render"):
+        NULL_STATS.count("paragraphs")
+    assert not NULL_STATS.enabled
+    assert NULL_STATS.to_dict() == {"phases": {}, "counters": {}}
+
+
+def test_templating_records_its_phases(make_template):
+    stats = Stats()
+    template = Templating(make_template(paragraphs=4, table_rows=1), None, START, END, VALUES, stats=stats)
+    template.sub_templates()
+    template.to_bytes()
+    assert {"parse", "elements", "index", "save"} <= set(stats.seconds)
+    # 4 body paragraphs, and 2 in each of the 2 table cells, the header and the footer.
+    assert stats.counters["paragraphs_scanned"] == 12
+    assert stats.counters["cells"] == 2
@@ -0,0 +1,240 @@
+import copy
+import io
+
+import docx
+import pytest
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+from lxml import etree
+
+from conftest import END, OTHER_VALUES, RECORDS, START, VALUES, parts, table_rows, text
+from stats import Stats
+from templating import ENGINES, SEPARATORS, CompiledTemplate, Templating
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("split", [1, 2, 3, 5, 12])
+def test_placeholders_split_across_runs(make_template, engine, split):
+    path = make_template(paragraphs=4, split=split, table_rows=2, sections=2)
+    template = Templating(path, None, START, END, VALUES, engine)
+    template.sub_templates()
+    result = text(template.to_bytes())
+    assert "[[" not in result and "]]" not in result
+    for value in VALUES.values():
+        assert value in result
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_value_is_written_into_the_run_of_the_key(tmp_path, engine):
+    document = docx.Document()
+    paragraph = document.add_paragraph()
+    for run in ["Dear ", "[", "[con", "tact]", "]", ", hello"]:
+        paragraph.add_run(run)
+    path = str(tmp_path / "runs.docx")
+    document.save(path)
+
+    template = Templating(path, None, START, END, {"contact": "Jane"}, engine)
+    template.sub_templates()
+    runs = docx.Document(io.BytesIO(template.to_bytes())).paragraphs[0].runs
+    # The value takes the formatting of the run the key starts in.
+    assert [run.text for run in runs] == ["Dear ", "", "Jane", "", "", ", hello"]
+
+
+def test_placeholders_of_one_paragraph_are_substituted_together(tmp_path):
+    document = docx.Document()
+    paragraph = document.add_paragraph()
+    for run in ["[[company]", "] and [", "[contact]] of [[com", "pany]]"]:
+        paragraph.add_run(run)
+    path = str(tmp_path / "runs.docx")
+    document.save(path)
+
+    template = Templating(path, None, START, END, {"company": "Acme", "contact": "Jane"})
+    template.sub_templates()
+    paragraph = docx.Document(io.BytesIO(template.to_bytes())).paragraphs[0]
+    assert paragraph.text == "Acme and Jane of Acme"
+
+
+def body_paragraphs(content: bytes) -> list:
+    return [paragraph.text for paragraph in docx.Document(io.BytesIO(content)).paragraphs]
+
+
+def add_content_control(cell, *runs: str):
+    """Adds a content control (w:sdt) to the table CELL, holding a paragraph of the RUNS."""
+    xml_runs = "".join(f"<w:r><w:t>{run}</w:t></w:r>" for run in runs)
+    cell._tc.append(
+        parse_xml(
+            f'<w:sdt {nsdecls("w")}><w:sdtPr/><w:sdtContent><w:p>{xml_runs}</w:p></w:sdtContent></w:sdt>'
+        )
+    )
+
+
+def test_engines_write_the_same_parts(make_template):
+    path = make_template(paragraphs=5, split=3, table_rows=2, sections=2, media=True)
+    # The paragraphs of the content controls of a table cell are templated too.
+    document = docx.Document(path)
+    table = document.add_table(rows=1, cols=1)
+    add_content_control(table.cell(0, 0), "Name: [[con", "tact]]")
+    document.save(path)
+
+    contents = []
+    for engine in ENGINES:
+        template = Templating(path, None, START, END, VALUES, engine)
+        template.sub_templates()
+        content = template.to_bytes()
+        assert "[[" not in text(content)
+        contents.append(parts(content))
+    # The zip timestamps may differ, the content of every part may not.
+    assert contents[0] == contents[1]
+
+
+def add_text_box(paragraph, text: str):
+    """Adds a text box (w:txbxContent) holding a paragraph of TEXT to the PARAGRAPH."""
+    paragraph._p.append(
+        parse_xml(
+            f'<w:r {nsdecls("w")} xmlns:v="urn:schemas-microsoft-com:vml"><w:pict><v:shape><v:textbox><w:txbxContent>'
+            f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>"
+            "</w:txbxContent></v:textbox></v:shape></w:pict></w:r>"
+        )
+    )
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nested_tables_and_text_boxes_are_templated(tmp_path, engine):
+    document = docx.Document()
+    cell = document.add_table(rows=1, cols=1).cell(0, 0)
+    cell.text = "Outer [[company]]"
+    cell.add_table(rows=1, cols=1).cell(0, 0).text = "Inner [[contact]]"
+    add_text_box(document.add_paragraph("Box: "), "Mail [[email]]")
+    path = str(tmp_path / "nested.docx")
+    document.save(path)
+
+    template = Templating(path, None, START, END, VALUES, engine)
+    template.sub_templates()
+    result = text(template.to_bytes())
+    assert "[[" not in result
+    for value in ("Outer company value", "Inner contact value", "Mail email value"):
+        assert value in result
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_linked_and_shared_headers_are_visited_once(tmp_path, engine):
+    document = docx.Document()
+    document.sections[0].header.is_linked_to_previous = False
+    document.sections[0].header.paragraphs[0].text = "Header of [[company]]"
+    document.add_paragraph("Body of [[contact]]")
+    # The second section is linked to the header of the first, the third refers to the same part.
+    document.add_section()
+    document.add_section()
+    reference = document.sections[0]._sectPr.find(qn("w:headerReference"))
+    document.sections[2]._sectPr.insert(0, copy.deepcopy(reference))
+    path = str(tmp_path / "headers.docx")
+    document.save(path)
+
+    stats = Stats()
+    template = Templating(path, None, START, END, VALUES, engine, stats=stats)
+    template.sub_templates()
+    assert stats.counters["paragraphs_scanned"] == len(document.paragraphs) + 1
+    content = template.to_bytes()
+    # The linked sections are not given headers of their own.
+    assert [name for name in parts(content) if name.startswith("word/header")] == ["word/header1.xml"]
+    assert text(content).count("Header of company value") == 1
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_compiled_template_matches_templating(make_template, engine):
+    path = make_template(paragraphs=4, split=3, table_rows=2, sections=2, media=True)
+    compiled = CompiledTemplate(path, START, END, engine)
+    template = Templating(path, None, START, END, VALUES, engine)
+    template.sub_templates()
+    assert parts(compiled.render_bytes(VALUES)) == parts(template.to_bytes())
+
+
+def test_compiled_template_renders_are_isolated(make_template):
+    compiled = CompiledTemplate(make_template(paragraphs=4, split=2, table_rows=2), START, END)
+    first = compiled.render_bytes(VALUES)
+    other = compiled.render_bytes(OTHER_VALUES)
+    again = compiled.render_bytes(VALUES)
+    assert parts(first) == parts(again)
+    assert "value" not in text(other)
+    # The parsed template is left untouched.
+    assert "[[" in text(compiled.render_bytes({}))
+
+
+def test_compiled_template_reads_bytes(make_template):
+    path = make_template(paragraphs=2)
+    with open(path, "rb") as file:
+        content = file.read()
+    assert parts(CompiledTemplate(content, START, END).render_bytes(VALUES)) == parts(
+        CompiledTemplate(path, START, END).render_bytes(VALUES)
+    )
+
+
+@pytest.mark.parametrize("separator", SEPARATORS)
+def test_combined_render_repeats_the_body(make_template, separator):
+    compiled = CompiledTemplate(make_template(paragraphs=3, split=2, media=True), START, END)
+    content = compiled.render_combined_bytes([VALUES, OTHER_VALUES, VALUES], separator)
+    body = etree.fromstring(parts(content)["word/document.xml"]).find(qn("w:body"))
+    texts = "".join(node.text or "" for node in body.iter(qn("w:t")))
+    assert texts.count("email value") == 2 and texts.count("other email") == 1
+    if separator == "page":
+        breaks = [br for br in body.iter(qn("w:br")) if br.get(qn("w:type")) == "page"]
+        assert len(breaks) == 2
+    else:
+        assert len(list(body.iter(qn("w:sectPr")))) == 3
+    # Every drawing has its own id.
+    ids = [element.get("id") for element in body.iter("{*}docPr")]
+    assert len(ids) == 3 and len(set(ids)) == 3
+
+
+def test_combined_render_needs_records(make_template):
+    compiled = CompiledTemplate(make_template(), START, END)
+    with pytest.raises(ValueError):
+        compiled.render_combined([])
+    with pytest.raises(ValueError):
+        compiled.render_combined([VALUES], "column")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_loops_are_repeated_for_the_records(loop_template, engine):
+    template = Templating(loop_template, None, START, END, {"company": "Acme"}, engine, records=RECORDS)
+    template.sub_templates()
+    content = template.to_bytes()
+    assert body_paragraphs(content) == ["Contacts of Acme:", "Name: John", "Name: Jane", "End of Acme"]
+    assert table_rows(content) == [
+        ["Name", "Email"],
+        ["John", "john@acme.test"],
+        ["Jane", "jane@acme.test"],
+    ]
+
+
+def test_loops_without_records(loop_template):
+    template = Templating(loop_template, None, START, END, {"company": "Acme"})
+    template.sub_templates()
+    # Without records the loops are left as they are.
+    assert "[[#each]]" in body_paragraphs(template.to_bytes())
+
+    template = Templating(loop_template, None, START, END, {"company": "Acme"}, records=[])
+    template.sub_templates()
+    # With no records the loops are removed.
+    content = template.to_bytes()
+    assert body_paragraphs(content) == ["Contacts of Acme:", "End of Acme"]
+    assert table_rows(content) == [["Name", "Email"]]
+
+
+def test_compiled_loops_match_templating(loop_template):
+    compiled = CompiledTemplate(loop_template, START, END)
+    template = Templating(loop_template, None, START, END, {"company": "Acme"}, records=RECORDS)
+    template.sub_templates()
+    assert parts(compiled.render_bytes({"company": "Acme"}, records=RECORDS)) == parts(
+        template.to_bytes()
+    )
+
+
+def test_compiled_loops_do_not_leak_into_later_renders(loop_template):
+    compiled = CompiledTemplate(loop_template, START, END)
+    compiled.render_bytes({"company": "Acme"}, records=RECORDS)
+    assert body_paragraphs(compiled.render_bytes({"company": "Bolt"}, records=RECORDS[:1])) == [
+        "Contacts of Bolt:",
+        "Name: John",
+        "End of Bolt",
+    ]